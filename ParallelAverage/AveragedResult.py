@@ -1,4 +1,6 @@
 from .CollectiveResult import CollectiveResult
+from .RunStatistics import RunStatistics
+from .RunSet import RunSet
 from .json_numpy import NumpyEncoder, NumpyDecoder
 from copy import deepcopy
 import json
@@ -6,6 +8,7 @@ import json
 
 def load_averaged_result(database_entry, encoding):
     output = database_entry.output
+    timing = RunStatistics.from_json(output.get("timing"))
 
     return AveragedResult(
         output["result"],
@@ -18,9 +21,11 @@ def load_averaged_result(database_entry, encoding):
             database_entry.job_path,
             output["raw_results_map"],
             database_entry["job_name"],
-            encoding
+            encoding,
+            timing
         ) if "raw_results_map" in output else None,
-        database_entry["job_name"]
+        database_entry["job_name"],
+        timing
     )
 
 
@@ -34,6 +39,7 @@ class AveragedResult:
         failed_run_ids,
         runs,
         job_name,
+        timing=None,
     ):
         self.data = data
         self.estimated_error = deepcopy(estimated_error)
@@ -42,6 +48,7 @@ class AveragedResult:
         self.failed_run_ids = failed_run_ids
         self.runs = runs
         self.job_name = job_name
+        self.timing = timing or RunStatistics()
 
     @property
     def _meta_info_fields(self):
@@ -49,7 +56,8 @@ class AveragedResult:
             self.successful_run_ids,
             self.failed_run_ids,
             self.runs,
-            self.job_name
+            self.job_name,
+            self.timing
         )
 
     def to_json(self):
@@ -57,10 +65,11 @@ class AveragedResult:
             data=json.loads(json.dumps(self.data, cls=NumpyEncoder)),
             estimated_error=json.loads(json.dumps(self.estimated_error, cls=NumpyEncoder)),
             estimated_variance=json.loads(json.dumps(self.estimated_variance, cls=NumpyEncoder)),
-            successful_run_ids=self.successful_run_ids,
-            failed_run_ids=self.failed_run_ids,
+            successful_run_ids=self.successful_run_ids.to_json(),
+            failed_run_ids=self.failed_run_ids.to_json(),
             runs=None,
-            job_name=self.job_name
+            job_name=self.job_name,
+            timing=self.timing.to_json()
         )
 
     @staticmethod
@@ -69,10 +78,11 @@ class AveragedResult:
             json.loads(json.dumps(obj["data"]), cls=NumpyDecoder),
             json.loads(json.dumps(obj["estimated_error"]), cls=NumpyDecoder),
             json.loads(json.dumps(obj["estimated_variance"]), cls=NumpyDecoder),
-            obj["successful_run_ids"],
-            obj["failed_run_ids"],
+            RunSet.from_json(obj["successful_run_ids"]),
+            RunSet.from_json(obj["failed_run_ids"]),
             None,
-            obj["job_name"]
+            obj["job_name"],
+            RunStatistics.from_json(obj.get("timing"))
         )
 
     def __str__(self):
@@ -0,0 +1,91 @@
+from pathlib import Path
+import hashlib
+import json
+import time
+import os
+
+
+class BlobStore:
+    """
+    A content-addressed store of the serialized inputs of jobs in `.parallel_average/blobs/`.
+    Each blob is named by the sha1 of its bytes, hence identical sessions or functions are only stored once,
+    however many jobs refer to them.
+    """
+
+    dir_name = "blobs"
+    # a job refers to its blobs only once its input is written, until then they are protected by their age
+    grace_period = 3600
+
+    def __init__(self, parallel_average_path):
+        self.path = Path(parallel_average_path) / self.dir_name
+
+    def file(self, key):
+        return self.path / key
+
+    def put(self, data):
+        key = hashlib.sha1(data).hexdigest()
+        blob_file = self.file(key)
+        if not self.touch(key):
+            self.path.mkdir(exist_ok=True)
+            tmp_file = blob_file.with_name(f"{key}.{os.getpid()}.tmp")
+            tmp_file.write_bytes(data)
+            os.replace(tmp_file, blob_file)
+
+        return key
+
+    def touch(self, key):
+        """renews the grace period of a blob, which is reused by a new job. Returns False if there is no such blob."""
+        try:
+            os.utime(self.file(key))
+            return True
+        except FileNotFoundError:
+            return False
+
+    def collect_garbage(self, referenced_keys):
+        if not self.path.exists():
+            return
+
+        expired = time.time() - self.grace_period
+        for blob_file in self.path.iterdir():
+            if blob_file.name in referenced_keys or blob_file.name.endswith(".tmp"):
+                continue
+            try:
+                if blob_file.stat().st_mtime < expired:
+                    blob_file.unlink()
+            except FileNotFoundError:
+                pass
+
+
+input_blobs = ["session_blob", "run_task_blob"]
+
+
+def job_input_files(input_path, parameters):
+    """returns the paths of the interpreter state and of the function of a job"""
+
+    blob_store = BlobStore(Path(input_path).parent.parent)
+
+    # legacy
+    if "run_task_blob" not in parameters:
+        return input_path / "session.pkl", input_path / "run_task.d"
+
+    return (
+        blob_store.file(parameters["session_blob"]) if parameters["session_blob"] else None,
+        blob_store.file(parameters["run_task_blob"])
+    )
+
+
+def referenced_blobs(parallel_average_path):
+    """returns the keys of all blobs referred to by any job in `parallel_average_path`"""
+
+    keys = set()
+    for parameters_file in Path(parallel_average_path).glob("*/input/run_task_arguments.json"):
+        try:
+            with open(parameters_file) as f:
+                parameters = json.load(f)
+        except (OSError, ValueError):
+            continue
+
+        keys.update(parameters[name] for name in input_blobs if parameters.get(name))
+        keys.update(parameters.get("array_blobs", []))
+
+    return keys
@@ -1,6 +1,18 @@
-from .json_numpy import NumpyEncoder, NumpyDecoder
+from .RawResultsFile import RawResultsFile
+from .RunStatistics import RunStatistics
+from .RunSet import RunSet, run_sets_by_file, ravel_run_id
+from .json_numpy import load_npy
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from bisect import bisect_right
+from ast import literal_eval
+from pathlib import Path
+import numpy as np
 import json
-import pickle
+import os
+
+
+default_cache_size = 2**28
 
 
 def load_collective_result(database_entry, encoding):
@@ -11,96 +23,306 @@ def load_collective_result(database_entry, encoding):
         database_entry.job_path,
         output["raw_results_map"],
         database_entry["job_name"],
-        encoding
+        encoding,
+        RunStatistics.from_json(output.get("timing"))
     )
 
 
+def file_size(raw_results_file):
+    return sum(p.stat().st_size for p in raw_results_file.files)
+
+
+class DecodedFiles:
+    """
+    keeps decoded raw-results files in memory, evicting the least recently used ones once their total size exceeds
+    `max_bytes`. The size of a file on disk serves as an estimate of its decoded size.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        # file_id -> (runs, size)
+        self.files = OrderedDict()
+
+    def get(self, file_id):
+        if file_id not in self.files:
+            return None
+
+        self.files.move_to_end(file_id)
+        return self.files[file_id][0]
+
+    def add(self, file_id, runs, size):
+        if size > self.max_bytes:
+            return
+
+        self.files[file_id] = (runs, size)
+        self.total_bytes += size
+        while self.total_bytes > self.max_bytes:
+            _, (_, evicted_size) = self.files.popitem(last=False)
+            self.total_bytes -= evicted_size
+
+    def clear(self):
+        self.files.clear()
+        self.total_bytes = 0
+
+
 class CollectiveResult:
-    def __init__(self, run_ids, job_path, raw_results_map, job_name, encoding):
-        self.run_ids = run_ids
-        if isinstance(self.run_ids[0], str):
-            self.run_ids = [eval(run_id) for run_id in self.run_ids]
-        self.run_ids = sorted(self.run_ids)
+    def __init__(self, run_ids, job_path, raw_results_map, job_name, encoding, timing=None, cache_size=None):
+        # the run ids are iterated in sorted order
+        self.run_ids = run_ids if isinstance(run_ids, RunSet) else RunSet.from_json(run_ids)
 
         self.job_path = job_path
-        self.raw_results_map = raw_results_map
+        # file id -> runs in that raw-results file
+        self.raw_results_map = run_sets_by_file(raw_results_map, self.run_ids.N_runs)
+        # (step, residue) -> ranges (k_start, k_stop, file_id) of the runs k * step + residue of all files, sorted by
+        # their start. Blocks of different files may interleave, but not those sharing their step and residue.
+        self.file_progressions = defaultdict(list)
+        for file_id, runs in self.raw_results_map.items():
+            for k_start, k_stop, step, residues in runs.blocks:
+                for residue in residues:
+                    self.file_progressions[step, residue].append((k_start, k_stop, file_id))
+        for progressions in self.file_progressions.values():
+            progressions.sort()
+        self.file_steps = sorted(set(step for step, residue in self.file_progressions))
         self.job_name = job_name
         self.encoding = encoding
+        self.timing = timing or RunStatistics()
+        self.decoded_files = DecodedFiles(default_cache_size if cache_size is None else cache_size)
+        # file id -> RawResultsFile, which keeps the index of its file once read
+        self.raw_results_files = {}
+        self.file_sizes = {}
+
+    def raw_results_file(self, file_id):
+        if file_id not in self.raw_results_files:
+            self.raw_results_files[file_id] = RawResultsFile(self.job_path.data_path, file_id, self.encoding)
+        return self.raw_results_files[file_id]
+
+    def decoded_file(self, file_id):
+        """
+        returns all runs of a raw-results file, which is decoded only if it is not in the cache.
+        Returns None for a file which does not fit into the cache, whose runs are read one by one instead.
+        """
+
+        runs = self.decoded_files.get(file_id)
+        if runs is None:
+            if file_id not in self.file_sizes:
+                self.file_sizes[file_id] = file_size(self.raw_results_file(file_id))
+            if self.file_sizes[file_id] > self.decoded_files.max_bytes:
+                return None
+
+            runs = self.raw_results_file(file_id).load_all()
+            self.decoded_files.add(file_id, runs, self.file_sizes[file_id])
+        return runs
+
+    def file_items(self, file_id, run_ids):
+        """yields the results of `run_ids`, which are stored in the raw-results file `file_id`"""
+
+        runs = self.decoded_file(file_id)
+        if runs is None:
+            keys = (repr(run_id) for run_id in run_ids)
+            for run_id, (key, result) in zip(run_ids, self.raw_results_file(file_id).load(keys)):
+                yield run_id, result
+        else:
+            for run_id in run_ids:
+                yield run_id, runs[repr(run_id)]
+
+    def file_id(self, run_id):
+        index = ravel_run_id(run_id, self.run_ids.N_runs)
+        for step in self.file_steps:
+            k, residue = divmod(index, step)
+            progressions = self.file_progressions.get((step, residue), [])
+            i = bisect_right(progressions, (k, float("inf"))) - 1
+            if i >= 0 and k < progressions[i][1]:
+                return progressions[i][2]
+        raise KeyError(run_id)
 
     def __iter__(self):
         return iter(self.run_ids)
 
     def __getitem__(self, run_id):
-        if not isinstance(run_id, str):
-            run_id = repr(run_id)
-
-        file_id = self.raw_results_map[run_id]
-        file_path = self.job_path.data_path / f"{file_id}_raw_results.{self.encoding}"
-
-        if self.encoding == "json":
-            with open(file_path) as f:
-                return json.load(f, cls=NumpyDecoder)[run_id]
-        elif self.encoding == "pickle":
-            if file_path.stat().st_size > 0:
-                with open(file_path, 'rb') as f:
-                    return pickle.load(f)[run_id]
-            else:
-                return None
+        if isinstance(run_id, str):
+            run_id = literal_eval(run_id)
+        elif isinstance(run_id, list):
+            run_id = tuple(run_id)
+
+        for run_id, result in self.file_items(self.file_id(run_id), [run_id]):
+            return result
 
     def __len__(self):
         return len(self.run_ids)
 
     def __repr__(self):
-        return repr(dict(self.items()))
+        return repr(self.to_dict())
 
     def __str__(self):
-        return str(dict(self.items()))
+        return str(self.to_dict())
+
+    def to_dict(self):
+        runs = dict(self.items_by_file())
+        return {run_id: runs[run_id] for run_id in self.run_ids}
 
     def keys(self):
         return self.run_ids
 
     def values(self):
-        for run_id in self:
-            yield self[run_id]
+        for run_id, result in self.items():
+            yield result
 
     def items(self):
-        for run_id in self:
-            yield run_id, self[run_id]
+        """
+        yields all runs in the order of `run_ids`, reading consecutive runs of the same raw-results file together.
+        Only the decoded files in the cache are kept, hence files whose runs interleave and which do not fit into the
+        cache together are decoded repeatedly. `items_by_file` reads each of them once instead.
+        """
 
-    def replace_output(self, new_dict, new_encoding=None):
-        new_encoding = new_encoding or self.encoding
+        file_id = None
+        run_ids = []
+        for run_id in self.run_ids:
+            run_file_id = self.file_id(run_id)
+            if run_file_id != file_id and run_ids:
+                yield from self.file_items(file_id, run_ids)
+                run_ids = []
+            file_id = run_file_id
+            run_ids.append(run_id)
+
+        if run_ids:
+            yield from self.file_items(file_id, run_ids)
+
+    def items_by_file(self):
+        """
+        yields all runs grouped by their raw-results file instead of in the order of `run_ids`,
+        such that each file is decoded at most once per pass.
+        """
+
+        for file_id, run_ids in self.raw_results_map.items():
+            yield from self.file_items(file_id, run_ids)
+
+    def values_by_file(self):
+        for run_id, result in self.items_by_file():
+            yield result
+
+    def array_source(self, index, dtype):
+        """describes what `as_array` stacks, such that a memory-mapped array can be checked against it"""
+
+        return dict(
+            index=repr(index),
+            dtype=None if dtype is None else np.dtype(dtype).str,
+            encoding=self.encoding,
+            run_ids=self.run_ids.to_json(),
+            # rewriting a raw-results file (see `replace_output`) changes its modification time
+            files={
+                file_id: [p.stat().st_mtime_ns for p in self.raw_results_file(file_id).files]
+                for file_id in sorted(self.raw_results_map)
+            }
+        )
+
+    def as_array(self, index=None, out=None, mmap_path=None, dtype=None):
+        """
+        stacks the results of all runs (or the `index`-th element of each result) into an array,
+        whose first axis follows the order of `run_ids`. The results are written straight into `out`, if given,
+        or into a newly allocated array of `dtype`. By default, that is the dtype of the first result and the other
+        results have to be safely castable to it. With `mmap_path`, the array is a memory-mapped .npy file instead,
+        which is loaded without touching the raw results again as long as the runs and their files are unchanged.
+        """
+
+        if mmap_path is not None:
+            mmap_path = Path(mmap_path)
+            source_path = mmap_path.with_name(mmap_path.name + ".json")
+            source = self.array_source(index, dtype)
+            if out is None and mmap_path.exists() and source_path.exists():
+                with open(source_path) as f:
+                    if json.load(f) == json.loads(json.dumps(source)):
+                        return load_npy(mmap_path)
 
-        for run_id in new_dict:
-            if not isinstance(run_id, str):
-                run_id = repr(run_id)
+        if not self.run_ids:
+            # the shape of a result is unknown without any run, an empty memory-map is not possible either
+            return out if out is not None else np.empty((0,), dtype if dtype is not None else np.float64)
 
-            file_id = self.raw_results_map[run_id]
-            file_path = self.job_path / "data_output" / f"{file_id}_raw_results.{self.encoding}"
+        tmp_path = None
+        for run_id, result in self.items_by_file():
+            if index is not None:
+                result = result[index]
+            result = np.asarray(result)
 
-            if self.encoding == "json":
-                with open(file_path) as f:
-                    raw_results = json.load(f, cls=NumpyDecoder)
-            elif self.encoding == "pickle":
-                if file_path.stat().st_size > 0:
-                    with open(file_path, 'rb') as f:
-                        raw_results = pickle.load(f)
+            if out is None:
+                shape = (len(self.run_ids),) + result.shape
+                out_dtype = dtype if dtype is not None else result.dtype
+                if mmap_path is not None:
+                    tmp_path = mmap_path.with_name(mmap_path.name + ".tmp")
+                    out = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=out_dtype, shape=shape)
                 else:
-                    raw_results = {}
+                    out = np.empty(shape, dtype=out_dtype)
 
-            raw_results[run_id] = new_dict[eval(run_id)]
+            if result.shape != out.shape[1:]:
+                raise ValueError(
+                    f"[ParallelAverage] result of run {run_id} has shape {result.shape} instead of {out.shape[1:]}"
+                )
+            # an explicit `dtype` is a request to cast, otherwise a result must not lose precision
+            if dtype is None and not np.can_cast(result.dtype, out.dtype, "safe"):
+                raise ValueError(
+                    f"[ParallelAverage] result of run {run_id} has dtype {result.dtype}, which cannot be stored "
+                    f"in an array of dtype {out.dtype}. Pass `dtype` to choose a common dtype."
+                )
 
-            file_path = self.job_path / "data_output" / f"{file_id}_raw_results.{new_encoding}"
+            out[self.run_ids.rank(run_id)] = result
 
-            if new_encoding == "json":
-                with open(file_path, "w") as f:
-                    json.dump(raw_results, f, cls=NumpyEncoder, indent=2)
-            elif new_encoding == "pickle":
-                with open(file_path, "wb") as f:
-                    pickle.dump(raw_results, f)
+        if tmp_path is not None:
+            out.flush()
+            del out
+            # replace atomically, such that memory-maps of a previous version stay intact.
+            # The description of the array is removed meanwhile, such that a crash cannot leave a stale one behind.
+            if source_path.exists():
+                source_path.unlink()
+            os.replace(tmp_path, mmap_path)
+            tmp_source_path = source_path.with_name(source_path.name + ".tmp")
+            with open(tmp_source_path, 'w') as f:
+                json.dump(source, f)
+            os.replace(tmp_source_path, source_path)
+            return load_npy(mmap_path)
 
-        if new_encoding != self.encoding:
-            for file_id in self.raw_results_map.values():
-                file_path = self.job_path / "data_output" / f"{file_id}_raw_results.{self.encoding}"
-                file_path.unlink()
+        return out
+
+    def replace_output(self, new_dict, new_encoding=None, workers=None):
+        """
+        replaces the results of the runs in `new_dict` and optionally re-encodes all raw results.
+        The updates are grouped by raw-results file, such that each file is read and written once.
+        With `workers` > 1, the files are rewritten by a process pool.
+        """
+
+        new_encoding = new_encoding or self.encoding
+
+        new_runs_by_file = defaultdict(dict)
+        for run_id, result in new_dict.items():
+            if isinstance(run_id, str):
+                run_id = literal_eval(run_id)
+            new_runs_by_file[self.file_id(run_id)][repr(run_id)] = result
+
+        file_ids = set(self.raw_results_map) if new_encoding != self.encoding else set(new_runs_by_file)
+        jobs = [
+            (self.job_path.data_path, file_id, self.encoding, new_encoding, new_runs_by_file.get(file_id, {}))
+            for file_id in sorted(file_ids)
+        ]
+
+        if not workers or workers <= 1 or len(jobs) <= 1:
+            for args in jobs:
+                replace_raw_results(*args)
+        else:
+            with ProcessPoolExecutor(workers) as processes:
+                list(processes.map(replace_raw_results, *zip(*jobs)))
 
         self.encoding = new_encoding
+        self.decoded_files.clear()
+        self.raw_results_files.clear()
+        self.file_sizes.clear()
+
+
+def replace_raw_results(data_path, file_id, encoding, new_encoding, new_runs):
+    target = RawResultsFile(data_path, file_id, new_encoding)
+    source = target if target.files else RawResultsFile(data_path, file_id, encoding)
+
+    runs = source.load_all()
+    runs.update(new_runs)
+    target.replace_all(runs)
+
+    if new_encoding != encoding:
+        RawResultsFile(data_path, file_id, encoding).remove()
@@ -1,7 +1,8 @@
 from .JobPath import JobPath
-from .json_numpy import NumpyEncoder, NumpyDecoder
+from .json_numpy import NumpyEncoder, FingerprintEncoder, NumpyDecoder, load_npy
 from .gathering import gather
-from .simpleflock import SimpleFlock
+from .database import open_database, database_path, same_job
+from .RunSet import RunSet, run_sets_by_file
 from copy import deepcopy
 from pathlib import Path
 from datetime import datetime, timedelta
@@ -9,36 +10,37 @@ import dateutil.parser
 import json
 
 
+# arrays of at least this many bytes are replaced by their fingerprint, when `fingerprint_arguments=True`
+default_fingerprint_threshold = 2**16
+
+
 class DatabaseEntry(dict):
-    def __init__(self, input_dict, path):
-        super().__init__(deepcopy(input_dict))
+    def __init__(self, input_dict, path, fingerprint_threshold=None):
+        # the arguments are copied anyway by the conversion below
+        super().__init__({
+            key: value if key in ("args", "kwargs") else deepcopy(value) for key, value in input_dict.items()
+        })
+
+        self.database_path = database_path(path)
 
-        path = Path(path)
-        if path.name.endswith("parallel_average_database.json"):
-            self.database_path = path
+        if fingerprint_threshold is None:
+            encoder = dict(cls=NumpyEncoder)
         else:
-            self.database_path = path / "parallel_average_database.json"
+            encoder = dict(cls=FingerprintEncoder, threshold=fingerprint_threshold)
 
         # convert fields to a genuine json objects
         self["N_runs"] = json.loads(
             json.dumps(self["N_runs"])
         )
         self["args"] = json.loads(
-            json.dumps(self["args"], cls=NumpyEncoder),
+            json.dumps(self["args"], **encoder),
         )
         self["kwargs"] = json.loads(
-            json.dumps(self["kwargs"], cls=NumpyEncoder),
+            json.dumps(self["kwargs"], **encoder),
         )
 
     def __eq__(self, other):
-        try:
-            return all(self[key] == other[key] for key in [
-                "function_name", "args", "kwargs", "N_runs", "average_results"
-            ])
-        except KeyError:
-            return all(self[key if key != "average_results" else "average_arrays"] == other[key] for key in [
-                "function_name", "args", "kwargs", "N_runs", "average_results"
-            ])
+        return same_job(self, other)
 
     def __ne__(self, other):
         return not self == other
@@ -64,14 +66,25 @@ class DatabaseEntry(dict):
     @property
     def output(self):
         with open(self.output_path) as f:
-            result = json.load(f, cls=NumpyDecoder)
-            if "successful_runs" not in result:
-                result["successful_runs"] = [0] * result["N_total_runs"]
-            return result
+            result = json.load(
+                f,
+                cls=NumpyDecoder,
+                load_blob=lambda array_file: load_npy(self.output_path.parent / array_file)
+            )
+        if "successful_runs" in result:
+            result["successful_runs"] = RunSet.from_json(result["successful_runs"], self["N_runs"])
+        else:
+            # legacy
+            result["successful_runs"] = RunSet([[0, result["N_total_runs"]]], self["N_runs"])
+        result["failed_runs"] = RunSet.from_json(result["failed_runs"], self["N_runs"])
+        if "raw_results_map" in result:
+            result["raw_results_map"] = run_sets_by_file(result["raw_results_map"], self["N_runs"])
+
+        return result
 
-    def check_result(self):
+    def check_result(self, workers=None):
         if self["status"] != "completed":
-            gather(self)
+            gather(self, workers)
 
         output = self.output
         needs_update = False
@@ -109,34 +122,19 @@ class DatabaseEntry(dict):
 
         return len(output["successful_runs"]) > 0
 
+    @property
+    def database(self):
+        return open_database(self.database_path)
+
     def save(self):
-        with SimpleFlock(str(self.database_path.parent / "dblock")):
-            with open(self.database_path, 'r+') as f:
-                if self.database_path.stat().st_size == 0:
-                    entries = []
-                else:
-                    entries = json.load(f)
-
-                entries = [DatabaseEntry(entry, self.database_path) for entry in entries]
-                entries = [e for e in entries if e != self]
-                entries.append(self)
-                f.seek(0)
-                json.dump(entries, f, indent=2, cls=NumpyEncoder)
-                f.truncate()
+        self.database.save(self)
 
     def remove(self):
-        with SimpleFlock(str(self.database_path.parent / "dblock")):
-            with open(self.database_path, 'r+') as f:
-                if self.database_path.stat().st_size == 0:
-                    entries = []
-                else:
-                    entries = json.load(f)
-
-                entries = [DatabaseEntry(entry, self.database_path) for entry in entries]
-                entries = [e for e in entries if e != self]
-                f.seek(0)
-                json.dump(entries, f, indent=2, cls=NumpyEncoder)
-                f.truncate()
+        self.database.remove(self)
+
+    def find_in_database(self):
+        entry = self.database.find(self)
+        return DatabaseEntry(entry, self.database_path) if entry is not None else None
 
     @property
     def best_fitting_entries_in_database(self):
@@ -174,37 +172,18 @@ class DatabaseEntry(dict):
 
     @classmethod
     def from_job_name(cls, job_name, path="."):
-        path = Path(path)
-        database_path = path / "parallel_average_database.json"
-        with SimpleFlock(str(database_path.parent / "dblock")):
-            with database_path.open() as f:
-                if database_path.stat().st_size == 0:
-                    raise ValueError(f"[ParallelAverage] Database at {database_path.resolve()} is empty.")
-                else:
-                    entries = json.load(f)
-
-        for entry in entries:
-            if entry["job_name"] == job_name:
-                return cls(entry, database_path)
+        database = open_database(path)
+        entry = database.find_job_name(job_name)
+        if entry is None:
+            raise ValueError(f"[ParallelAverage] Couldn't find job {job_name} in database at {database.path.resolve()}")
 
-        raise ValueError(f"[ParallelAverage] Couldn't find job {job_name} in database at {database_path.resolve()}")
+        return cls(entry, database.path)
 
 
 def load_database(path):
-    path = Path(path)
-    if path.name.endswith("parallel_average_database.json"):
-        database_path = path
-    else:
-        database_path = path / "parallel_average_database.json"
-
-    with SimpleFlock(str(database_path.parent / "dblock")):
-        with database_path.open() as f:
-            if database_path.stat().st_size == 0:
-                entries = []
-            else:
-                entries = json.load(f)
+    database = open_database(path)
 
-    return (DatabaseEntry(entry, database_path) for entry in entries)
+    return (DatabaseEntry(entry, database.path) for entry in database.load())
 
 
 def volume(x):
@@ -220,7 +199,7 @@ def volume(x):
 def check_latest_jobs(path='.', weeks=1, days=0):
     since = datetime.now() - timedelta(weeks=weeks) - timedelta(days=days)
     latest_entries = (
-        entry for entry in load_database(Path(path) / "parallel_average_database.json")
+        entry for entry in load_database(path)
         if "datetime" in entry and dateutil.parser.parse(entry["datetime"]) > since
     )
     for entry in latest_entries:
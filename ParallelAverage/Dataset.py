@@ -4,37 +4,230 @@ import json
 
 
 class WeightedSample:
+    # `ParallelAverage.Dataset` is shadowed by the class of the same name, hence these classes have to be
+    # located via the package. Otherwise dill pickles them by value and `isinstance` fails in the tasks.
+    __module__ = "ParallelAverage"
+
     def __init__(self, sample, weight):
         self.sample = sample
         self.weight = weight
 
 
+class SampleBatch:
+    """Many samples stacked along axis 0, which are added to a Dataset at once. Optionally with a weight per sample."""
+    __module__ = "ParallelAverage"
+
+    def __init__(self, samples, weights=None):
+        self.samples = samples
+        self.weights = weights
+
+    def __len__(self):
+        return len(self.samples)
+
+
 class Dataset:
-    def __init__(self):
+    """
+    Accumulates the (weighted) sum and sum of squares of samples.
+
+    Array samples are accumulated in place into arrays, which are preallocated from the first sample.
+    If `accumulator_dtype` is a single precision type ("float32" or "complex64"), array samples are accumulated into
+    their weighted mean and the sum of their weighted squared deviations from it instead, which are merged by the
+    update of Chan et al. and hence keep the precision of the estimated error with half the memory of double
+    precision sums. Only the rounding of the mean accumulates, by about sqrt(num_samples) times the resolution of
+    single precision relative to the mean, which matters only for samples whose spread is many orders of magnitude
+    below their magnitude.
+    """
+
+    def __init__(self, accumulator_dtype=None):
         self.data = 0
         self.data_squared = 0
         self.total_weight = 0
         self.num_samples = 0
+        self.accumulator_dtype = accumulator_dtype
+        # single precision: [mean, sum of squared deviations]
+        self.moments = None
+        self._buffers = None
+
+    @property
+    def allocated(self):
+        return self.moments is not None or isinstance(self.data, np.ndarray)
+
+    def allocate(self, sample):
+        if self.accumulator_dtype is None:
+            dtype = np.result_type(sample.dtype, np.float64)
+            self.data = np.zeros(sample.shape, dtype)
+            self.data_squared = np.zeros(sample.shape, np.finfo(dtype).dtype)
+            return
+
+        real_dtype = np.finfo(self.accumulator_dtype).dtype
+        dtype = np.promote_types(real_dtype, np.complex64) if np.iscomplexobj(sample) else real_dtype
+        if np.finfo(dtype).bits < 64:
+            self.moments = [np.zeros(sample.shape, dtype), np.zeros(sample.shape, real_dtype)]
+        else:
+            self.data = np.zeros(sample.shape, dtype)
+            self.data_squared = np.zeros(sample.shape, real_dtype)
+
+    def allocate_buffers(self):
+        self._buffers = [np.empty_like(self.data), np.empty_like(self.data_squared)]
+
+    def accumulate(self, i, x, weight):
+        """adds `weight * x` to the i-th accumulator in place"""
+
+        accumulator = (self.data, self.data_squared)[i]
+        if weight == 1:
+            np.add(accumulator, x, out=accumulator)
+        else:
+            y = self._buffers[i]
+            np.multiply(x, weight, out=y)
+            np.add(accumulator, y, out=accumulator)
+
+    def merge_moments(self, weight, mean, squared_deviations=None):
+        """
+        merges samples of total `weight` with the weighted `mean` and sum of weighted `squared_deviations` from it into
+        the moments. The scratch arrays are only allocated for the duration of the call.
+        """
+
+        if weight == 0:
+            return
+
+        own_mean, own_squared_deviations = self.moments
+        own_weight = self.total_weight
+        total_weight = own_weight + weight
+
+        previous_mean = own_mean.copy()
+        # in the precision of the samples, which resolves deviations below the resolution of the accumulators
+        delta = np.subtract(mean, own_mean)
+        delta *= weight / total_weight
+        own_mean += delta
+
+        # both parts contribute their weight times the squared deviation of their mean from the merged one, which is
+        # taken as stored, such that its rounding does not accumulate into the squared deviations
+        for part_weight, part_mean in ((own_weight, previous_mean), (weight, mean)):
+            np.subtract(part_mean, own_mean, out=delta)
+            squared = np.abs(delta)
+            np.square(squared, out=squared)
+            squared *= part_weight
+            own_squared_deviations += squared
+        if squared_deviations is not None:
+            own_squared_deviations += squared_deviations
 
     def add_sample(self, sample):
+        if isinstance(sample, SampleBatch):
+            return self.add_batch(sample)
+
         if isinstance(sample, WeightedSample):
             weight = sample.weight
             sample = sample.sample
         else:
             weight = 1
 
-        self.data += weight * sample if weight > 0 else 0
-        self.data_squared += weight * abs(sample)**2 if weight > 0 else 0
+        if not isinstance(sample, np.ndarray) or sample.ndim == 0:
+            self.data += weight * sample if weight > 0 else 0
+            self.data_squared += weight * abs(sample)**2 if weight > 0 else 0
+        elif weight > 0:
+            if not self.allocated:
+                self.allocate(sample)
+
+            if self.moments is not None:
+                self.merge_moments(weight, sample)
+            else:
+                if self._buffers is None:
+                    self.allocate_buffers()
+
+                self.accumulate(0, sample, weight)
+                squared = self._buffers[1]
+                np.abs(sample, out=squared)
+                np.square(squared, out=squared)
+                self.accumulate(1, squared, weight)
+
         self.total_weight += weight
         self.num_samples += 1
 
+    def add_batch(self, batch):
+        """adds all samples of `batch` by one vectorized sum and sum of squares"""
+
+        samples = np.asarray(batch.samples)
+        if samples.ndim > 1 and len(samples) > 0 and self.accumulator_dtype is not None:
+            if not self.allocated:
+                self.allocate(samples[0])
+            if self.moments is not None:
+                return self.add_batch_moments(samples, batch.weights)
+
+        if batch.weights is None:
+            weights = None
+            total_weight = len(samples)
+            batch_sum = samples.sum(axis=0)
+        else:
+            weights = np.asarray(batch.weights)
+            total_weight = weights.sum()
+            batch_sum = np.tensordot(weights, samples, axes=1)
+
+        batch_sum_squared = sum_of_squares(samples.real, weights)
+        if np.iscomplexobj(samples):
+            batch_sum_squared += sum_of_squares(samples.imag, weights)
+
+        if samples.ndim == 1:
+            self.data += batch_sum
+            self.data_squared += batch_sum_squared
+        elif len(samples) > 0:
+            if not self.allocated:
+                self.allocate(samples[0])
+
+            self.accumulate(0, batch_sum, 1)
+            self.accumulate(1, batch_sum_squared, 1)
+
+        self.total_weight += total_weight
+        self.num_samples += len(samples)
+
+    def add_batch_moments(self, samples, weights):
+        weights = np.ones(len(samples)) if weights is None else np.asarray(weights)
+        total_weight = weights.sum()
+        if total_weight > 0:
+            mean = np.tensordot(weights / total_weight, samples, axes=1)
+            deviations = samples - mean
+            squared_deviations = sum_of_squares(deviations.real, weights)
+            if np.iscomplexobj(deviations):
+                squared_deviations += sum_of_squares(deviations.imag, weights)
+
+            self.merge_moments(total_weight, mean, squared_deviations)
+
+        self.total_weight += total_weight
+        self.num_samples += len(samples)
+
+    @property
+    def accumulated(self):
+        """the (weighted) sum and sum of squares, which are computed in double precision from the moments"""
+
+        if self.moments is None:
+            return self.data, self.data_squared
+
+        mean, squared_deviations = self.moments
+        mean = mean.astype(np.promote_types(mean.dtype, np.float64))
+        return self.total_weight * mean, squared_deviations + self.total_weight * abs(mean)**2
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state["_buffers"] = None
+        return state
+
     def __iadd__(self, other):
         if other == 0:
             return self
         assert isinstance(other, Dataset)
 
-        self.data += other.data
-        self.data_squared += other.data_squared
+        if other.moments is not None and (self.moments is not None or self.num_samples == 0 and not self.allocated):
+            if self.moments is None:
+                self.moments = [np.zeros_like(moment) for moment in other.moments]
+            self.merge_moments(other.total_weight, *other.moments)
+        else:
+            if self.moments is not None:
+                self.data, self.data_squared = self.accumulated
+                self.moments = None
+
+            data, data_squared = other.accumulated
+            self.data += data
+            self.data_squared += data_squared
+
         self.total_weight += other.total_weight
         self.num_samples += other.num_samples
 
@@ -48,30 +241,51 @@ class Dataset:
 
     @property
     def mean(self):
-        return self.data / self.total_weight
+        if self.moments is not None:
+            return self.moments[0].copy()
+
+        return self.accumulated[0] / self.total_weight
 
     @property
     def mean_squared(self):
-        return self.data_squared / self.total_weight
+        return self.accumulated[1] / self.total_weight
+
+    @property
+    def variance(self):
+        """the weighted variance of the samples"""
+
+        if self.moments is not None:
+            return self.moments[1] / self.total_weight
+
+        return self.mean_squared - abs(self.mean)**2
 
     @property
     def estimated_error(self):
         if self.num_samples <= 1:
             return None
 
-        return np.sqrt((self.mean_squared - abs(self.mean)**2) / (self.num_samples - 1))
+        return np.sqrt(self.variance / (self.num_samples - 1))
 
     @property
     def estimated_variance(self):
         if self.num_samples <= 1:
             return None
 
-        return self.num_samples / (self.num_samples - 1) * (self.mean_squared - abs(self.mean)**2)
+        return self.num_samples / (self.num_samples - 1) * self.variance
 
     def to_json(self):
+        if self.moments is not None:
+            return dict(
+                mean=encode_array(self.moments[0]),
+                squared_deviations=encode_array(self.moments[1]),
+                total_weight=self.total_weight,
+                num_samples=self.num_samples
+            )
+
+        data, data_squared = self.accumulated
         return dict(
-            data=encode_array(self.data),
-            data_squared=encode_array(self.data_squared),
+            data=encode_array(data),
+            data_squared=encode_array(data_squared),
             total_weight=self.total_weight,
             num_samples=self.num_samples
         )
@@ -79,6 +293,12 @@ class Dataset:
     @staticmethod
     def from_json(obj):
         result = Dataset()
+        if "mean" in obj:
+            result.moments = [decode_array(obj["mean"]), decode_array(obj["squared_deviations"])]
+            result.total_weight = obj["total_weight"]
+            result.num_samples = obj["num_samples"]
+            return result
+
         result.data = decode_array(obj["data"]) if "dtype" not in obj else decode_array(obj)
         result.data_squared = decode_array(obj["data_squared"]) if "data_squared" in obj else (
             abs(np.array(result.data))**2
@@ -88,6 +308,13 @@ class Dataset:
         return result
 
 
+def sum_of_squares(samples, weights=None):
+    if weights is None:
+        return np.einsum("i...,i...->...", samples, samples)
+
+    return np.einsum("i,i...,i...->...", weights, samples, samples)
+
+
 def decode_array(json_obj):
     return json.loads(json.dumps(json_obj), cls=NumpyDecoder)
 
@@ -1,4 +1,5 @@
 from pathlib import Path
+import json
 import re
 
 
@@ -21,6 +22,23 @@ class JobPath:
 
         yield from (t for t in self.data_path.iterdir() if str(t).endswith("_task_output.json"))
 
+    @property
+    def parameters(self):
+        parameters_path = self.input_path / "run_task_arguments.json"
+        if not parameters_path.exists():
+            return {}
+
+        with open(parameters_path) as f:
+            return json.load(f)
+
+    @property
+    def progress_path(self):
+        return self / "progress"
+
+    @property
+    def output_arrays_path(self):
+        return self / "output_arrays"
+
     @property
     def task_ids(self):
         if not self.data_path.iterdir():
@@ -0,0 +1,199 @@
+"""
+Raw results of a task (keep_runs=True) are stored in an append-only log of framed records.
+Each record consists of a header (length of the run-id, length of the payload), the run-id and the encoded result.
+When a task is done an offset index is written next to the log, such that single runs can be read by seeking.
+
+With the "npy" encoding, arrays of a result are stored as aligned .npy blobs within the record
+and are memory-mapped when being read.
+
+Legacy jobs store all runs of a task in a single dict-file, which is still supported for reading.
+"""
+
+from .json_numpy import NumpyEncoder, NpyEncoder, NumpyDecoder, load_npy
+import numpy as np
+import struct
+import json
+import pickle
+import io
+import os
+
+
+header = struct.Struct("<IQ")
+blobs_header = struct.Struct("<Q")
+blob_alignment = 64
+
+
+class RawResultsFile:
+    def __init__(self, data_path, file_id, encoding):
+        self.encoding = encoding
+        self.legacy_path = data_path / f"{file_id}_raw_results.{encoding}"
+        self.log_path = data_path / f"{file_id}_raw_results.{encoding}.log"
+        self.index_path = data_path / f"{file_id}_raw_results.{encoding}.index"
+        self._index = None
+
+    @property
+    def is_log(self):
+        return self.log_path.exists()
+
+    @property
+    def files(self):
+        return [p for p in (self.legacy_path, self.log_path, self.index_path) if p.exists()]
+
+    def encode(self, result, payload_offset=0):
+        if self.encoding == "json":
+            return json.dumps(result, cls=NumpyEncoder).encode()
+        elif self.encoding == "pickle":
+            return pickle.dumps(result)
+        elif self.encoding == "npy":
+            blobs = io.BytesIO()
+            blobs_offset = payload_offset + blobs_header.size
+
+            def add_blob(arr):
+                blobs.write(bytes(-(blobs_offset + blobs.tell()) % blob_alignment))
+                offset = blobs.tell()
+                np.lib.format.write_array(blobs, arr, allow_pickle=False)
+                return offset
+
+            skeleton = json.dumps(result, cls=NpyEncoder, add_blob=add_blob).encode()
+            return blobs_header.pack(blobs.tell()) + blobs.getvalue() + skeleton
+
+    def read(self, f, offset, length):
+        f.seek(offset)
+        payload = f.read(length if self.encoding != "npy" else blobs_header.size)
+
+        if self.encoding == "json":
+            return json.loads(payload.decode(), cls=NumpyDecoder)
+        elif self.encoding == "pickle":
+            return pickle.loads(payload)
+        elif self.encoding == "npy":
+            blobs_length, = blobs_header.unpack(payload)
+            blobs_offset = offset + blobs_header.size
+            f.seek(blobs_offset + blobs_length)
+            skeleton = f.read(length - blobs_header.size - blobs_length)
+            return json.loads(
+                skeleton.decode(),
+                cls=NumpyDecoder,
+                load_blob=lambda blob: load_npy(self.log_path, blobs_offset + blob)
+            )
+
+    @property
+    def index(self):
+        if self._index is None:
+            if self.index_path.exists():
+                with open(self.index_path) as f:
+                    self._index = json.load(f)
+            else:
+                self._index = self.scan()
+        return self._index
+
+    def scan(self):
+        """rebuilds the index of an unfinished task by reading only the record headers"""
+        index = {}
+        if not self.is_log:
+            return index
+
+        with open(self.log_path, 'rb') as f:
+            size = f.seek(0, 2)
+            offset = f.seek(0)
+            while offset + header.size <= size:
+                key_length, payload_length = header.unpack(f.read(header.size))
+                payload_offset = offset + header.size + key_length
+                if payload_offset + payload_length > size:
+                    # truncated record of a crashed or still writing task
+                    break
+                run_id = f.read(key_length).decode()
+                index[run_id] = [payload_offset, payload_length]
+                offset = f.seek(payload_offset + payload_length)
+
+        return index
+
+    def append(self, run_id, result):
+        index = self.index
+        if self.index_path.exists():
+            self.index_path.unlink()
+
+        with open(self.log_path, 'ab') as f:
+            index[run_id] = self.write_record(f, run_id, result)
+
+    def write_record(self, f, run_id, result):
+        key = run_id.encode()
+        payload_offset = f.tell() + header.size + len(key)
+        payload = self.encode(result, payload_offset)
+        f.write(header.pack(len(key), len(payload)) + key + payload)
+
+        return [payload_offset, len(payload)]
+
+    def finalize(self):
+        with open(self.index_path, 'w') as f:
+            json.dump(self.index, f)
+
+    def __getitem__(self, run_id):
+        if not self.is_log:
+            return self.load_legacy()[run_id]
+
+        with open(self.log_path, 'rb') as f:
+            return self.read(f, *self.index[run_id])
+
+    def load(self, run_ids):
+        """yields the given runs as (run_id, result), opening the log only once"""
+        if not self.is_log:
+            runs = self.load_legacy()
+            for run_id in run_ids:
+                yield run_id, runs[run_id]
+            return
+
+        with open(self.log_path, 'rb') as f:
+            for run_id in run_ids:
+                yield run_id, self.read(f, *self.index[run_id])
+
+    def load_all(self):
+        if not self.is_log:
+            return self.load_legacy()
+
+        with open(self.log_path, 'rb') as f:
+            return {
+                run_id: self.read(f, offset, length)
+                for run_id, (offset, length) in self.index.items()
+            }
+
+    def replace_all(self, runs):
+        """
+        writes `runs` to a temporary log with its index, which then replace the current files by renaming.
+        Readers see either the previous or the new log, never a partially written one.
+        """
+
+        tmp_log_path = self.log_path.with_name(self.log_path.name + ".tmp")
+        tmp_index_path = self.index_path.with_name(self.index_path.name + ".tmp")
+
+        index = {}
+        with open(tmp_log_path, 'wb') as f:
+            for run_id, result in runs.items():
+                index[run_id] = self.write_record(f, run_id, result)
+        with open(tmp_index_path, 'w') as f:
+            json.dump(index, f)
+
+        # without an index, readers scan whichever log is in place
+        if self.index_path.exists():
+            self.index_path.unlink()
+        os.replace(tmp_log_path, self.log_path)
+        os.replace(tmp_index_path, self.index_path)
+        if self.legacy_path.exists():
+            self.legacy_path.unlink()
+
+        self._index = index
+
+    def remove(self):
+        for p in self.files:
+            p.unlink()
+        self._index = None
+
+    def load_legacy(self):
+        if not self.legacy_path.exists() or self.legacy_path.stat().st_size == 0:
+            return {}
+
+        if self.encoding == "json":
+            with open(self.legacy_path) as f:
+                return json.load(f, cls=NumpyDecoder)
+        elif self.encoding == "pickle":
+            with open(self.legacy_path, 'rb') as f:
+                return pickle.load(f)
@@ -0,0 +1,451 @@
+from bisect import bisect_left, bisect_right
+from heapq import merge
+from ast import literal_eval
+from itertools import accumulate
+from math import prod, gcd, lcm
+
+
+def ravel_run_id(run_id, N_runs):
+    """returns the position of `run_id` in the row-major order of all run ids"""
+
+    if isinstance(N_runs, int):
+        return run_id
+
+    index = 0
+    for i, n in zip(run_id, N_runs):
+        index = index * n + i
+    return index
+
+
+def unravel_run_id(index, N_runs):
+    """returns the run id at position `index` in the row-major order of all run ids"""
+
+    if isinstance(N_runs, int):
+        return index
+
+    run_id = []
+    for n in reversed(N_runs):
+        index, i = divmod(index, n)
+        run_id.append(i)
+    return tuple(reversed(run_id))
+
+
+# steps up to which interleaving blocks are merged arithmetically, see `combined`
+max_step = 2**12
+
+
+def block(r):
+    """
+    converts a range [start, stop], a progression [start, stop, step] or a set of residue classes
+    [start, stop, step, residues] (with `start` and `stop` multiples of `step`) into a block
+    [k_start, k_stop, step, residues], which holds the runs k * step + r for k_start <= k < k_stop and r in residues.
+    Returns None if it is empty.
+    """
+
+    if len(r) == 4:
+        start, stop, step, residues = r
+        return simplified([start // step, stop // step, step, tuple(residues)])
+
+    start, stop, step = r if len(r) == 3 else (r[0], r[1], 1)
+    if start >= stop:
+        return None
+
+    k_start, residue = divmod(start, step)
+    return simplified([k_start, (stop - 1 - residue) // step + 1, step, (residue,)])
+
+
+def simplified(b):
+    """returns the block `b` with the smallest step that describes its runs"""
+
+    k_start, k_stop, step, residues = b
+    if k_start >= k_stop or not residues:
+        return None
+
+    if len(residues) == step:
+        return [k_start * step, k_stop * step, 1, (0,)]
+
+    if k_stop - k_start == 1 and residues[-1] - residues[0] + 1 == len(residues):
+        start = k_start * step + residues[0]
+        return [start, start + len(residues), 1, (0,)]
+
+    if len(residues) > 1:
+        for d in range(2, step):
+            period = step // d
+            if step % d or len(residues) % period:
+                continue
+            base = residues[:len(residues) // period]
+            if base[-1] < d and residues == tuple(r + j * d for j in range(period) for r in base):
+                return simplified([k_start * period, k_stop * period, d, base])
+
+    return [k_start, k_stop, step, tuple(residues)]
+
+
+def span(b):
+    k_start, k_stop, step, residues = b
+    return k_start * step + residues[0], (k_stop - 1) * step + residues[-1] + 1
+
+
+def count(b):
+    return (b[1] - b[0]) * len(b[3])
+
+
+def block_indices(b):
+    k_start, k_stop, step, residues = b
+    if len(residues) == 1:
+        return range(k_start * step + residues[0], (k_stop - 1) * step + residues[0] + 1, step)
+    return (k * step + r for k in range(k_start, k_stop) for r in residues)
+
+
+def block_contains(b, index):
+    k, r = divmod(index, b[2])
+    if not b[0] <= k < b[1]:
+        return False
+    i = bisect_left(b[3], r)
+    return i < len(b[3]) and b[3][i] == r
+
+
+def append_index(blocks, index):
+    """appends `index`, which is larger than all runs of `blocks`, extending the last block if possible"""
+
+    if blocks:
+        last = blocks[-1]
+        if count(last) == 1:
+            # a single run starts a progression with any step
+            first = span(last)[0]
+            step = index - first
+            blocks[-1] = [first // step, first // step + 2, step, (first % step,)]
+            return
+        if len(last[3]) == 1 and index == last[1] * last[2] + last[3][0]:
+            last[1] += 1
+            return
+
+    blocks.append([index, index + 1, 1, (0,)])
+
+
+def append_block(blocks, b):
+    """appends the block `b`, whose span follows those of `blocks`, merging it with the last block if possible"""
+
+    if count(b) == 1:
+        append_index(blocks, span(b)[0])
+        return
+
+    if blocks:
+        last = blocks[-1]
+        if last[2:] == b[2:] and last[1] == b[0]:
+            last[1] = b[1]
+            return
+        if count(last) == 1 and len(b[3]) == 1 and span(b)[0] - span(last)[0] == b[2]:
+            blocks[-1] = [b[0] - 1, b[1], b[2], b[3]]
+            return
+
+    blocks.append(list(b))
+
+
+def residue_ranges(blocks, step):
+    """returns the runs of `blocks` as ranges [k_start, k_stop) of k for each residue r of the runs k * step + r"""
+
+    ranges = {}
+    for k_start, k_stop, block_step, residues in blocks:
+        m = step // block_step
+        for j in range(m):
+            # k * block_step + r = (K * m + j) * block_step + r = K * step + (j * block_step + r)
+            K_start = -(-(k_start - j) // m)
+            K_stop = (k_stop - 1 - j) // m + 1
+            if K_start < K_stop:
+                for r in residues:
+                    ranges.setdefault(j * block_step + r, []).append([K_start, K_stop])
+
+    return {r: merged_ranges(r_ranges) for r, r_ranges in ranges.items()}
+
+
+def merged_ranges(ranges):
+    result = []
+    for start, stop in sorted(ranges):
+        if result and start <= result[-1][1]:
+            result[-1][1] = max(result[-1][1], stop)
+        else:
+            result.append([start, stop])
+    return result
+
+
+def subtracted_ranges(ranges, others):
+    result = []
+    j = 0
+    for start, stop in ranges:
+        while j < len(others) and others[j][1] <= start:
+            j += 1
+        k = j
+        while k < len(others) and others[k][0] < stop:
+            if others[k][0] > start:
+                result.append([start, others[k][0]])
+            start = max(start, others[k][1])
+            k += 1
+        if start < stop:
+            result.append([start, stop])
+    return result
+
+
+def swept(ranges, step):
+    """
+    turns ranges of k for each residue into blocks, one per interval of k over which the set of residues is constant
+    """
+
+    boundaries = sorted({k for r_ranges in ranges.values() for r_range in r_ranges for k in r_range})
+    segments = [[] for i in range(len(boundaries) - 1)]
+    for r in sorted(ranges):
+        for k_start, k_stop in ranges[r]:
+            for i in range(bisect_left(boundaries, k_start), bisect_left(boundaries, k_stop)):
+                segments[i].append(r)
+
+    return [
+        simplified([boundaries[i], boundaries[i + 1], step, tuple(residues)])
+        for i, residues in enumerate(segments) if residues
+    ]
+
+
+def combined(blocks, subtracted=()):
+    """
+    returns the union of `blocks` minus the runs of `subtracted` as sorted blocks with disjoint spans.
+    Blocks whose spans overlap are brought to a common step and merged per residue, e.g. the round-robin shares of
+    tasks become a single block. Only blocks whose steps have no common multiple up to `max_step` are expanded
+    into their runs.
+    """
+
+    tagged = sorted([span(b), 0, b] for b in blocks) + sorted([span(b), 1, b] for b in subtracted)
+    tagged.sort(key=lambda t: t[0][0])
+
+    result = []
+    group = []
+    group_stop = None
+    for (start, stop), tag, b in tagged:
+        if group and start < group_stop:
+            group.append((tag, b))
+            group_stop = max(group_stop, stop)
+            continue
+
+        add_group(result, group)
+        group = [(tag, b)]
+        group_stop = stop
+    add_group(result, group)
+
+    return result
+
+
+def add_group(result, group):
+    kept = [b for tag, b in group if tag == 0]
+    removed = [b for tag, b in group if tag == 1]
+    if not kept:
+        return
+    if len(kept) == 1 and not removed:
+        append_block(result, kept[0])
+        return
+
+    # a few scattered runs, e.g. after failures, do not force a common step
+    kept = [b for b in kept if count(b) > 2] + [
+        [i, i + 1, 1, (0,)] for b in kept if count(b) <= 2 for i in block_indices(b)
+    ]
+    removed = [b for b in removed if count(b) > 2] + [
+        [i, i + 1, 1, (0,)] for b in removed if count(b) <= 2 for i in block_indices(b)
+    ]
+
+    step = 1
+    for b in kept + removed:
+        step = lcm(step, b[2])
+        if step > max_step:
+            break
+
+    if step <= max_step:
+        ranges = residue_ranges(kept, step)
+        removed_ranges = residue_ranges(removed, step)
+        for r in removed_ranges:
+            if r in ranges:
+                ranges[r] = subtracted_ranges(ranges[r], removed_ranges[r])
+        for b in swept(ranges, step):
+            append_block(result, b)
+        return
+
+    last_index = None
+    for index in merge(*map(block_indices, kept)):
+        if index != last_index and not any(block_contains(b, index) for b in removed):
+            append_index(result, index)
+        last_index = index
+
+
+class RunSet:
+    """
+    A set of runs, stored by their position in the row-major order of all run ids as sorted blocks with disjoint
+    spans. A block [k_start, k_stop, step, residues] holds the runs k * step + r for k_start <= k < k_stop and r in
+    residues. Hence, runs which are executed in chunks take up a single block per chunk, the runs assigned
+    round-robin to a task a single block with one residue and those of several of its tasks a single block as well.
+    Iterating yields the run ids themselves, i.e. tuples for a multi-dimensional `N_runs`.
+    """
+
+    def __init__(self, ranges=(), N_runs=None):
+        self.blocks = combined(filter(None, map(block, ranges)))
+        self.N_runs = tuple(N_runs) if isinstance(N_runs, list) else N_runs
+        # first run and number of preceding runs of each block, see `find` and `rank`
+        self._starts = None
+        self._offsets = None
+
+    @staticmethod
+    def from_blocks(blocks, N_runs):
+        run_set = RunSet([], N_runs)
+        run_set.blocks = blocks
+        return run_set
+
+    @staticmethod
+    def full(N_runs):
+        N_total_runs = N_runs if isinstance(N_runs, int) else prod(N_runs)
+        return RunSet([[0, N_total_runs]], N_runs)
+
+    @staticmethod
+    def from_run_ids(run_ids, N_runs=None):
+        run_ids = list(run_ids)
+        if N_runs is None:
+            # legacy: the shape of the runs is unknown, but enclosing them is enough to order them
+            if run_ids and not isinstance(run_ids[0], int):
+                N_runs = tuple(max(run_id[d] for run_id in run_ids) + 1 for d in range(len(run_ids[0])))
+            else:
+                N_runs = max(run_ids, default=-1) + 1
+
+        run_set = RunSet([], N_runs)
+        for index in sorted(ravel_run_id(run_id, run_set.N_runs) for run_id in run_ids):
+            run_set.add_index(index)
+        return run_set
+
+    def add_index(self, index):
+        if not self.blocks or index >= span(self.blocks[-1])[1]:
+            append_index(self.blocks, index)
+        elif not self.contains_index(index):
+            self.blocks = combined(self.blocks + [[index, index + 1, 1, (0,)]])
+        self._starts = None
+        self._offsets = None
+
+    def add(self, run_id):
+        self.add_index(ravel_run_id(run_id, self.N_runs))
+
+    def indices(self):
+        for b in self.blocks:
+            yield from block_indices(b)
+
+    def find(self, index):
+        """returns the position of the block containing `index`, or None"""
+
+        if self._starts is None:
+            self._starts = [span(b)[0] for b in self.blocks]
+        i = bisect_right(self._starts, index) - 1
+        if i >= 0 and block_contains(self.blocks[i], index):
+            return i
+        return None
+
+    def contains_index(self, index):
+        return self.find(index) is not None
+
+    def __contains__(self, run_id):
+        if isinstance(run_id, list):
+            run_id = tuple(run_id)
+        return self.contains_index(ravel_run_id(run_id, self.N_runs))
+
+    def rank(self, run_id):
+        """returns the position of `run_id` within this set"""
+
+        index = ravel_run_id(run_id, self.N_runs)
+        i = self.find(index)
+        if i is None:
+            raise KeyError(run_id)
+
+        if self._offsets is None:
+            self._offsets = list(accumulate(map(count, self.blocks), initial=0))
+        k_start, k_stop, step, residues = self.blocks[i]
+        k, r = divmod(index, step)
+        return self._offsets[i] + (k - k_start) * len(residues) + bisect_left(residues, r)
+
+    def split(self, n):
+        """splits this set into `n` parts of (almost) equal size, which take every `n`-th run in turn"""
+
+        parts = [[] for i in range(n)]
+        position = 0
+        for k_start, k_stop, step, residues in self.blocks:
+            # the runs of a residue follow each other every len(residues) positions, hence a part takes every
+            # `period`-th of them
+            period = n // gcd(n, len(residues))
+            for j, r in enumerate(residues):
+                for i in range(min(period, k_stop - k_start)):
+                    part = (position + i * len(residues) + j) % n
+                    parts[part].append(
+                        [(k_start + i) * step + r, (k_stop - 1) * step + r + 1, step * period]
+                    )
+            position += count([k_start, k_stop, step, residues])
+
+        return [RunSet(part, self.N_runs) for part in parts]
+
+    def __iter__(self):
+        return (unravel_run_id(index, self.N_runs) for index in self.indices())
+
+    def __len__(self):
+        return sum(map(count, self.blocks))
+
+    def __bool__(self):
+        return bool(self.blocks)
+
+    def __or__(self, other):
+        return RunSet.from_blocks(
+            combined(self.blocks + other.blocks), self.N_runs if self.N_runs is not None else other.N_runs
+        )
+
+    def __sub__(self, other):
+        return RunSet.from_blocks(combined(self.blocks, other.blocks), self.N_runs)
+
+    def __eq__(self, other):
+        return isinstance(other, RunSet) and (
+            self.blocks == other.blocks or
+            len(self) == len(other) and all(a == b for a, b in zip(self.indices(), other.indices()))
+        )
+
+    def __repr__(self):
+        return f"RunSet({self.to_json()['ranges']}, N_runs={self.N_runs})"
+
+    def to_json(self):
+        ranges = []
+        for k_start, k_stop, step, residues in self.blocks:
+            if step == 1:
+                ranges.append([k_start, k_stop])
+            elif len(residues) == 1:
+                ranges.append([k_start * step + residues[0], (k_stop - 1) * step + residues[0] + 1, step])
+            else:
+                ranges.append([k_start * step, k_stop * step, step, list(residues)])
+        return dict(ranges=ranges, N_runs=self.N_runs)
+
+    @staticmethod
+    def from_json(obj, N_runs=None):
+        if obj is None:
+            return RunSet([], N_runs)
+
+        # legacy
+        if isinstance(obj, list):
+            return RunSet.from_run_ids(
+                (literal_eval(run_id) if isinstance(run_id, str) else run_id for run_id in obj), N_runs
+            )
+
+        return RunSet(obj["ranges"], obj["N_runs"] if obj["N_runs"] is not None else N_runs)
+
+
+def run_sets_by_file(raw_results_map, N_runs=None):
+    """returns the runs of each raw-results file, given a map from run id to file id or from file id to runs"""
+
+    if raw_results_map is None:
+        return {}
+
+    # legacy
+    if any(isinstance(file_id, int) for file_id in raw_results_map.values()):
+        run_ids_by_file = {}
+        for run_id, file_id in raw_results_map.items():
+            run_ids_by_file.setdefault(str(file_id), []).append(literal_eval(run_id))
+        return {
+            file_id: RunSet.from_run_ids(run_ids, N_runs) for file_id, run_ids in run_ids_by_file.items()
+        }
+
+    return {
+        file_id: run_set if isinstance(run_set, RunSet) else RunSet.from_json(run_set, N_runs)
+        for file_id, run_set in raw_results_map.items()
+    }
@@ -0,0 +1,189 @@
+from math import frexp, sqrt
+import resource
+import sys
+import time
+
+
+quantities = ["wall_time", "cpu_time", "max_rss", "traced_memory"]
+units = dict(wall_time="s", cpu_time="s", max_rss="B", traced_memory="B")
+
+# `ru_maxrss` is given in kilobytes on Linux and in bytes on macOS
+rss_scale = 1 if sys.platform == "darwin" else 1024
+
+
+class Summary:
+    """
+    A mergeable summary of non-negative samples: count, sum, sum of squares, extrema and a histogram
+    with power-of-two bins. The key `e` counts samples in [2^(e-1), 2^e). Zeros are not binned.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.sum_of_squares = 0.0
+        self.min = None
+        self.max = None
+        self.histogram = {}
+
+    def add(self, x):
+        self.count += 1
+        self.sum += x
+        self.sum_of_squares += x**2
+        self.min = x if self.min is None else min(self.min, x)
+        self.max = x if self.max is None else max(self.max, x)
+        if x > 0:
+            e = frexp(x)[1]
+            self.histogram[e] = self.histogram.get(e, 0) + 1
+
+    def __iadd__(self, other):
+        self.count += other.count
+        self.sum += other.sum
+        self.sum_of_squares += other.sum_of_squares
+        if other.count:
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+        for e, n in other.histogram.items():
+            self.histogram[e] = self.histogram.get(e, 0) + n
+        return self
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    @property
+    def std(self):
+        if self.count < 2:
+            return None
+        return sqrt(max(self.sum_of_squares / self.count - self.mean**2, 0))
+
+    def quantile(self, q):
+        """returns an upper bound of the `q`-quantile, exact up to a factor of two"""
+
+        if not self.count:
+            return None
+
+        rank = q * self.count
+        cumulative = self.count - sum(self.histogram.values())
+        if cumulative >= rank:
+            return 0.0
+
+        for e in sorted(self.histogram):
+            cumulative += self.histogram[e]
+            if cumulative >= rank:
+                return min(2.0**e, self.max)
+        return self.max
+
+    def to_json(self):
+        return dict(
+            count=self.count,
+            sum=self.sum,
+            sum_of_squares=self.sum_of_squares,
+            min=self.min,
+            max=self.max,
+            histogram={str(e): n for e, n in sorted(self.histogram.items())}
+        )
+
+    @staticmethod
+    def from_json(obj):
+        result = Summary()
+        result.count = obj["count"]
+        result.sum = obj["sum"]
+        result.sum_of_squares = obj["sum_of_squares"]
+        result.min = obj["min"]
+        result.max = obj["max"]
+        result.histogram = {int(e): n for e, n in obj["histogram"].items()}
+        return result
+
+
+class RunStatistics:
+    """
+    Per-run wall time, cpu time and peak resident memory of a task, summarized in a compact form.
+    `max_rss` is the peak memory of the task's process after each run, `traced_memory` the peak of
+    the memory allocated by Python during a single run (only recorded if `trace_memory` is enabled).
+    """
+
+    def __init__(self, trace_memory=False):
+        self.summaries = {quantity: Summary() for quantity in quantities}
+        self.trace_memory = trace_memory
+
+    @staticmethod
+    def measurement(function, trace_memory=False):
+        """executes `function` and returns its result together with the measured resource usage"""
+
+        if trace_memory:
+            import tracemalloc
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            # `reset_peak` is only available since Python 3.9
+            getattr(tracemalloc, "reset_peak", tracemalloc.clear_traces)()
+
+        wall_time = time.perf_counter()
+        cpu_time = time.process_time()
+        result = function()
+
+        measurements = dict(
+            wall_time=time.perf_counter() - wall_time,
+            cpu_time=time.process_time() - cpu_time,
+            max_rss=resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * rss_scale
+        )
+        if trace_memory:
+            measurements["traced_memory"] = tracemalloc.get_traced_memory()[1]
+
+        return result, measurements
+
+    def record(self, measurements):
+        for quantity, value in measurements.items():
+            self.summaries[quantity].add(value)
+
+    def measure(self, function):
+        """executes `function` and records its resource usage"""
+
+        result, measurements = RunStatistics.measurement(function, self.trace_memory)
+        self.record(measurements)
+        return result
+
+    def __iadd__(self, other):
+        for quantity in quantities:
+            self.summaries[quantity] += other.summaries[quantity]
+        return self
+
+    def __getitem__(self, quantity):
+        return self.summaries[quantity]
+
+    @property
+    def report(self):
+        return {
+            quantity: dict(
+                mean=summary.mean,
+                std=summary.std,
+                min=summary.min,
+                median=summary.quantile(0.5),
+                p90=summary.quantile(0.9),
+                max=summary.max,
+                total=summary.sum if units[quantity] == "s" else None
+            )
+            for quantity, summary in self.summaries.items()
+            if summary.count
+        }
+
+    def __str__(self):
+        lines = [f"runs: {self.summaries['wall_time'].count}"]
+        for quantity, stats in self.report.items():
+            values = ", ".join(
+                f"{name}: {value:.3g} {units[quantity]}" for name, value in stats.items() if value is not None
+            )
+            lines.append(f"{quantity}: {values}")
+        return "\n".join(lines)
+
+    def __repr__(self):
+        return str(self)
+
+    def to_json(self):
+        return {quantity: summary.to_json() for quantity, summary in self.summaries.items() if summary.count}
+
+    @staticmethod
+    def from_json(obj):
+        result = RunStatistics()
+        for quantity, summary in (obj or {}).items():
+            result.summaries[quantity] = Summary.from_json(summary)
+        return result
@@ -1,17 +1,31 @@
 from .Dataset import Dataset
-from .simpleflock import SimpleFlock
+from .RunStatistics import RunStatistics
+from .RunSet import RunSet, run_sets_by_file
+from .simpleflock import SimpleFlock, merged_lock_statistics
 from .json_numpy import NumpyEncoder, NumpyDecoder
 from collections import defaultdict
+from pathlib import Path
 import json
+import re
+
+
+def lock_kind(path):
+    """the name of a lock file with task ids left out, such that e.g. the locks of all task files count as one kind"""
+
+    return re.sub(r"\d+", "*", Path(path).name)
 
 
 class Task:
     def __init__(self, database_entry, done=False):
         self.done = done
-        self.successful_runs = []
-        self.failed_runs = []
+        self.successful_runs = RunSet()
+        self.failed_runs = RunSet()
         self.error_message = {}
+        # file id -> runs in that raw-results file
         self.raw_results_map = {}
+        self.timing = RunStatistics()
+        # kind of lock file -> lock-wait statistics of the task processes, see `lock_kind`
+        self.lock_statistics = {}
         self.task_result = defaultdict(lambda: Dataset())
         self.database_entry = database_entry
         self.average_results = database_entry["average_results"]
@@ -20,10 +34,12 @@ class Task:
     def metainfo(self):
         return dict(
             done=self.done,
-            successful_runs=self.successful_runs,
-            failed_runs=self.failed_runs,
+            successful_runs=self.successful_runs.to_json(),
+            failed_runs=self.failed_runs.to_json(),
             error_message=self.error_message,
-            raw_results_map=self.raw_results_map,
+            raw_results_map={file_id: runs.to_json() for file_id, runs in self.raw_results_map.items()},
+            timing=self.timing.to_json(),
+            lock_statistics=self.lock_statistics,
         )
 
     @property
@@ -41,24 +57,51 @@ class Task:
 
     @property
     def raw_results_files(self):
+        data_path = self.database_entry.job_path.data_path
         return [
-            self.database_entry.job_path.data_path / f"{task_id}_raw_results.json"
-            for task_id in self.raw_results_map.values()
+            raw_results
+            for task_id in self.raw_results_map
+            for raw_results in data_path.glob(f"{task_id}_raw_results.*")
         ]
 
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        del state["database_entry"]
+        state["task_result"] = dict(self.task_result)
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.database_entry = None
+        self.timing = state.get("timing") or RunStatistics()
+        self.lock_statistics = state.get("lock_statistics", {})
+        self.task_result = defaultdict(lambda: Dataset(), state["task_result"])
+
     def to_be_averaged(self, i):
         return self.average_results is not None and (self.average_results == 'all' or i in self.average_results)
 
     def load(self, task_output_path):
-        with SimpleFlock(str(task_output_path) + ".lock"):
+        with SimpleFlock(str(task_output_path) + ".lock", shared=True):
             with open(task_output_path, 'r') as f:
                 output = json.load(f)
 
+        return self.load_output(output)
+
+    def load_output(self, output):
         self.done = output["done"] if ("done" in output) else True
-        self.successful_runs = output["successful_runs"] if "successful_runs" in output else [0] * output["N_local_runs"]
-        self.failed_runs = output["failed_runs"]
+        N_runs = self.database_entry.get("N_runs")
+        if "successful_runs" in output:
+            self.successful_runs = RunSet.from_json(output["successful_runs"], N_runs)
+        else:
+            # legacy
+            self.successful_runs = RunSet([[0, output["N_local_runs"]]], N_runs)
+        self.failed_runs = RunSet.from_json(output["failed_runs"], N_runs)
         self.error_message = output["error_message"]
-        self.raw_results_map = output["raw_results_map"] if "raw_results_map" in output else {}
+        self.raw_results_map = run_sets_by_file(output.get("raw_results_map"), N_runs)
+        self.timing = RunStatistics.from_json(output.get("timing"))
+        self.lock_statistics = merged_lock_statistics(*(
+            {lock_kind(path): stats} for path, stats in output.get("lock_statistics", {}).items()
+        ))
         self.task_result = defaultdict(lambda: Dataset())
         for i, r in enumerate(output["task_result"]):
             if self.to_be_averaged(i):
@@ -79,12 +122,16 @@ class Task:
     def incorporate(self, other):
         if not other.done:
             self.done = False
-        self.successful_runs += other.successful_runs
-        self.failed_runs += other.failed_runs
+        self.successful_runs |= other.successful_runs
+        self.failed_runs |= other.failed_runs
         if other.failed_runs:
             self.error_message = other.error_message
-        if other.raw_results_map is not None:
-            self.raw_results_map.update(other.raw_results_map)
+        for file_id, runs in other.raw_results_map.items():
+            if file_id in self.raw_results_map:
+                runs = self.raw_results_map[file_id] | runs
+            self.raw_results_map[file_id] = runs
+        self.timing += other.timing
+        self.lock_statistics = merged_lock_statistics(self.lock_statistics, other.lock_statistics)
         if other.successful_runs:
             for i, r in other.task_result.items():
                 if self.to_be_averaged(i):
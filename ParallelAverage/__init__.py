@@ -1,7 +1,7 @@
-from .parallel_average import parallel_average, parallel, do_submit, dont_submit, re_submit, print_job_output, cancel_job, cleanup, plot_average, volume, load_job_name, EntryDoesNotExist
-from .Dataset import WeightedSample, Dataset
+from .parallel_average import parallel_average, parallel, do_submit, dont_submit, re_submit, print_job_output, print_job_progress, job_progress, job_lock_statistics, cancel_job, cleanup, plot_average, volume, load_job_name, EntryDoesNotExist
+from .Dataset import WeightedSample, SampleBatch, Dataset
 from .DatabaseEntry import check_latest_jobs
-from .simpleflock import SimpleFlock
+from .simpleflock import SimpleFlock, lock_statistics
 from .json_numpy import NumpyEncoder
 from .AveragedResult import AveragedResult
 from .bundling import bundle_job, unbundle_job
@@ -13,13 +13,18 @@ __all__ = [
     "dont_submit",
     "re_submit",
     "print_job_output",
+    "print_job_progress",
+    "job_progress",
+    "job_lock_statistics",
     "cancel_job",
     "cleanup",
     "plot_average",
     "WeightedSample",
+    "SampleBatch",
     "load_job_name",
     "check_latest_jobs",
     "AveragedResult",
     "bundle_job",
-    "unbundle_job"
+    "unbundle_job",
+    "lock_statistics"
 ]
@@ -19,6 +19,9 @@ def bundle_job(job_name, path=".", compress=True):
         if entry.output_path.exists():
             tar.add(str(entry.output_path.resolve()), arcname=entry.output_path.name)
 
+        if job_path.output_arrays_path.exists():
+            tar.add(str(job_path.output_arrays_path.resolve()), arcname=job_path.output_arrays_path.name)
+
         tar.add(entry_path.name)
 
     entry_path.unlink()
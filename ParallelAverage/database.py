@@ -0,0 +1,255 @@
+"""
+The database keeps track of all jobs of a project. Two interchangeable backends are available:
+
+json:   a single file `parallel_average_database.json`, which is rewritten on every change.
+        This is the default and the format understood by the ParallelAverage-browser.
+sqlite: a file `parallel_average_database.sqlite`, which supports transactional single-row updates and
+        indexed lookups by job name and by a canonical hash of the arguments of a job.
+        An existing json-database is migrated once, when the sqlite backend is requested for the first time.
+
+Both backends exchange plain dicts. Wrapping them into `DatabaseEntry` objects is left to the caller.
+"""
+
+from .json_numpy import NumpyEncoder
+from .simpleflock import SimpleFlock
+from contextlib import contextmanager
+from pathlib import Path
+import hashlib
+import sqlite3
+import json
+
+
+key_fields = ["function_name", "args", "kwargs", "N_runs", "average_results"]
+
+
+def entry_key(entry):
+    # legacy
+    if "average_results" not in entry and "average_arrays" in entry:
+        return [entry[key if key != "average_results" else "average_arrays"] for key in key_fields]
+
+    return [entry[key] for key in key_fields]
+
+
+def same_job(entryA, entryB):
+    return entry_key(entryA) == entry_key(entryB)
+
+
+def normalized_numbers(obj):
+    """replaces integral floats and booleans by ints, such that numbers which compare equal are dumped alike"""
+
+    if isinstance(obj, bool):
+        return int(obj)
+    if isinstance(obj, float) and obj.is_integer():
+        return int(obj)
+    if isinstance(obj, dict):
+        return {key: normalized_numbers(value) for key, value in obj.items()}
+    if isinstance(obj, list):
+        return [normalized_numbers(value) for value in obj]
+    return obj
+
+
+def key_hash(entry):
+    # consistent with `same_job`, e.g. f(1) and f(1.0) are the same job
+    key = json.loads(json.dumps(entry_key(entry), cls=NumpyEncoder))
+    return hashlib.sha1(
+        json.dumps(normalized_numbers(key), sort_keys=True).encode()
+    ).hexdigest()
+
+
+class JsonDatabase:
+    name = "parallel_average_database.json"
+
+    def __init__(self, directory):
+        self.path = Path(directory) / self.name
+        self.lock_path = Path(directory) / "dblock"
+
+    @property
+    def is_empty(self):
+        return not self.path.exists() or self.path.stat().st_size == 0
+
+    def load(self):
+        if self.is_empty:
+            return []
+
+        with SimpleFlock(str(self.lock_path), shared=True):
+            with self.path.open() as f:
+                return json.load(f)
+
+    def find(self, entry):
+        return next((e for e in self.load() if same_job(e, entry)), None)
+
+    def find_job_name(self, job_name):
+        return next((e for e in self.load() if e["job_name"] == job_name), None)
+
+    @contextmanager
+    def modify(self):
+        self.path.touch()
+        with SimpleFlock(str(self.lock_path)):
+            with open(self.path, 'r+') as f:
+                entries = [] if self.path.stat().st_size == 0 else json.load(f)
+                yield entries
+                f.seek(0)
+                json.dump(entries, f, indent=2, cls=NumpyEncoder)
+                f.truncate()
+
+    def save(self, entry):
+        with self.modify() as entries:
+            entries[:] = [e for e in entries if not same_job(e, entry)] + [entry]
+
+    def save_all(self, new_entries):
+        new_entries = list(new_entries)
+        with self.modify() as entries:
+            entries[:] = [e for e in entries if not any(same_job(e, entry) for entry in new_entries)] + new_entries
+
+    def remove(self, entry):
+        with self.modify() as entries:
+            entries[:] = [e for e in entries if not same_job(e, entry)]
+
+    def remove_all(self, removed_entries):
+        removed_keys = {key_hash(entry) for entry in removed_entries}
+        with self.modify() as entries:
+            entries[:] = [e for e in entries if key_hash(e) not in removed_keys]
+
+
+class SqliteDatabase:
+    name = "parallel_average_database.sqlite"
+
+    # paths whose schema has already been set up by this process
+    initialized_paths = set()
+
+    def __init__(self, directory, name=None):
+        self.path = Path(directory) / (name or self.name)
+
+        if self.path in self.initialized_paths and self.path.exists():
+            return
+
+        with self.transaction() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "job_name TEXT PRIMARY KEY, key_hash TEXT NOT NULL, entry TEXT NOT NULL)"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS entries_key_hash ON entries (key_hash)")
+        self.initialized_paths.add(self.path)
+
+    @contextmanager
+    def transaction(self):
+        connection = sqlite3.connect(str(self.path), timeout=60)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    @property
+    def is_empty(self):
+        with self.transaction() as connection:
+            return connection.execute("SELECT NOT EXISTS (SELECT 1 FROM entries)").fetchone()[0]
+
+    def load(self):
+        with self.transaction() as connection:
+            return [json.loads(row[0]) for row in connection.execute("SELECT entry FROM entries ORDER BY rowid")]
+
+    def find(self, entry):
+        with self.transaction() as connection:
+            rows = connection.execute("SELECT entry FROM entries WHERE key_hash = ?", (key_hash(entry),))
+            return next((e for e in (json.loads(row[0]) for row in rows) if same_job(e, entry)), None)
+
+    def find_job_name(self, job_name):
+        with self.transaction() as connection:
+            row = connection.execute("SELECT entry FROM entries WHERE job_name = ?", (job_name,)).fetchone()
+            return json.loads(row[0]) if row is not None else None
+
+    def save(self, entry, connection=None):
+        if connection is None:
+            with self.transaction() as connection:
+                return self.save(entry, connection)
+
+        self.remove(entry, connection)
+        connection.execute(
+            "INSERT OR REPLACE INTO entries (job_name, key_hash, entry) VALUES (?, ?, ?)",
+            (entry["job_name"], key_hash(entry), json.dumps(entry, cls=NumpyEncoder))
+        )
+
+    def save_all(self, entries):
+        with self.transaction() as connection:
+            for entry in entries:
+                self.save(entry, connection)
+
+    def remove(self, entry, connection=None):
+        if connection is None:
+            with self.transaction() as connection:
+                return self.remove(entry, connection)
+
+        rows = connection.execute("SELECT job_name, entry FROM entries WHERE key_hash = ?", (key_hash(entry),))
+        for job_name, e in rows.fetchall():
+            if same_job(json.loads(e), entry):
+                connection.execute("DELETE FROM entries WHERE job_name = ?", (job_name,))
+
+    def remove_all(self, entries):
+        with self.transaction() as connection:
+            for entry in entries:
+                self.remove(entry, connection)
+
+    @classmethod
+    def migrate_from(cls, json_database):
+        directory = json_database.path.parent
+        with SimpleFlock(str(json_database.lock_path)):
+            if (directory / cls.name).exists():
+                return
+
+            # the database is built under a temporary name, such that other processes never see it half-migrated
+            tmp_path = directory / (cls.name + ".tmp")
+            if tmp_path.exists():
+                tmp_path.unlink()
+            database = cls(directory, tmp_path.name)
+            entries = [] if json_database.is_empty else json.loads(json_database.path.read_text())
+            with database.transaction() as connection:
+                for entry in entries:
+                    database.save(entry, connection)
+
+            database.path.rename(directory / cls.name)
+            if json_database.path.exists():
+                json_database.path.rename(json_database.path.with_name(json_database.name + ".migrated"))
+
+        print(f"[ParallelAverage] Info: migrated {len(entries)} entries from {json_database.path} to the sqlite-database")
+
+
+backends = {
+    "json": JsonDatabase,
+    "sqlite": SqliteDatabase
+}
+
+
+def resolve_backend(path, backend=None):
+    """
+    returns the directory and backend of the database located at `path`, which is either a directory or a database file.
+    If `backend` is None, the sqlite-database is used if it exists.
+    """
+
+    path = Path(path)
+    directory = path.parent if path.name.startswith("parallel_average_database") else path
+
+    if backend is None:
+        backend = "sqlite" if (directory / SqliteDatabase.name).exists() else "json"
+
+    if backend not in backends:
+        raise ValueError(
+            f"Unknown database backend: {backend}\n"
+            f"Supported options are: {list(backends)}"
+        )
+
+    return directory, backend
+
+
+def database_path(path, backend=None):
+    directory, backend = resolve_backend(path, backend)
+    return directory / backends[backend].name
+
+
+def open_database(path=".", backend=None):
+    directory, backend = resolve_backend(path, backend)
+
+    if backend == "sqlite" and not (directory / SqliteDatabase.name).exists():
+        SqliteDatabase.migrate_from(JsonDatabase(directory))
+
+    return backends[backend](directory)
@@ -1,46 +1,203 @@
 """
 This class produces a total result from each individual task result it finds in the 'data_output' folder.
 The total result has the same structure as an individual result.
+
+Gathering is incremental: a per-job gather state keeps the sum of all finished tasks (which is also stored on disk
+as a single task file) and the already loaded results of running tasks, along with the size and mtime of their files.
+Only task files that changed since the last gather are read again.
+
+With `workers` > 1, changed task files are read by a thread pool and decoded by a process pool,
+where each worker sums up its share of finished tasks by a pairwise tree-reduction.
 """
 
-from .json_numpy import NumpyEncoder
+from .json_numpy import NumpyEncoder, NpyEncoder, save_npy
+from .simpleflock import SimpleFlock
 from .Task import Task
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from itertools import repeat
 import json
+import pickle
+import os
+
+
+def gather(database_entry, workers=None):
+    with SimpleFlock(str(database_entry.job_path / "gather_lock")):
+        Gatherer(database_entry, workers).run().update_folder()
+
+
+def file_stat(path):
+    stat = path.stat()
+    return stat.st_size, stat.st_mtime_ns
+
+
+def read_task_file(name, task_file):
+    with SimpleFlock(str(task_file) + ".lock", shared=True):
+        stat = file_stat(task_file)
+        with open(task_file, 'rb') as f:
+            return name, stat, f.read()
+
 
+def tree_reduce(tasks):
+    while len(tasks) > 1:
+        for taskA, taskB in zip(tasks[::2], tasks[1::2]):
+            taskA.incorporate(taskB)
+        tasks = tasks[::2]
 
-def gather(database_entry):
-    Gatherer(database_entry).run().update_folder()
+    return tasks[0] if tasks else None
+
+
+def load_tasks(average_results, N_runs, contents):
+    """
+    decodes the task files given as (name, stat, content) and returns the names of the finished ones,
+    their sum and the running tasks.
+    """
+
+    finished_names = []
+    finished_tasks = []
+    running = {}
+    for name, stat, content in contents:
+        task = Task(dict(average_results=average_results, N_runs=N_runs)).load_output(json.loads(content))
+        if task.done:
+            finished_names.append(name)
+            finished_tasks.append(task)
+        else:
+            running[name] = (stat, task)
+
+    return finished_names, tree_reduce(finished_tasks), running
 
 
 class Gatherer:
-    def __init__(self, database_entry):
+    def __init__(self, database_entry, workers=None):
         self.database_entry = database_entry
+        self.workers = workers
         self.job_path = database_entry.job_path
         self.total_task = Task(self.database_entry)
-        self.partial_task = Task(self.database_entry, done=True)
         self.average_results = database_entry["average_results"]
+        self.encoding = self.job_path.parameters.get("encoding", "json")
+        self.state_path = self.job_path / "gather_state.pickle"
+
+    def load_state(self):
+        empty_state = dict(
+            partial_file=None,
+            partial_stat=None,
+            partial_task=Task(self.database_entry, done=True),
+            running={}
+        )
+
+        try:
+            with open(self.state_path, 'rb') as f:
+                state = pickle.load(f)
+        except Exception:
+            return empty_state
+
+        partial_file = state["partial_file"]
+        if partial_file is not None and (
+            not (self.job_path / partial_file).exists() or
+            file_stat(self.job_path / partial_file) != state["partial_stat"]
+        ):
+            # the task files have been modified by someone else
+            return empty_state
+
+        state["partial_task"].database_entry = self.database_entry
+        for stat, task in state["running"].values():
+            task.database_entry = self.database_entry
+
+        return state
+
+    def save_state(self):
+        tmp_path = self.job_path / (self.state_path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(self.state, f)
+        os.replace(tmp_path, self.state_path)
 
     def run(self):
-        self.finished_task_files = []
+        self.state = self.load_state()
+        self.partial_task = self.state["partial_task"]
+        self.changed = False
+        running = {}
+        changed_task_files = []
 
         for task_file in self.job_path.task_output_files:
-            task = Task(self.database_entry).load(task_file)
+            name = str(task_file.relative_to(self.job_path.path))
+            if name == self.state["partial_file"]:
+                continue
 
-            self.total_task.incorporate(task)
+            if name in self.state["running"] and self.state["running"][name][0] == file_stat(task_file):
+                running[name] = self.state["running"][name]
+            else:
+                changed_task_files.append((name, task_file))
+
+        finished_names, finished_task, new_running = self.load_tasks(changed_task_files)
+        self.finished_task_files = [self.job_path / name for name in finished_names]
+        if finished_task is not None:
+            self.partial_task.incorporate(finished_task)
+        for stat, task in new_running.values():
+            task.database_entry = self.database_entry
+        running.update(new_running)
 
-            if task.done:
-                self.finished_task_files.append(task_file)
-                self.partial_task.incorporate(task)
+        if changed_task_files or set(running) != set(self.state["running"]):
+            self.changed = True
+        self.state["running"] = running
+
+        self.total_task.incorporate(self.partial_task)
+        for stat, task in running.values():
+            self.total_task.incorporate(task)
 
         return self
 
+    def load_tasks(self, task_files):
+        if not self.workers or self.workers <= 1 or len(task_files) <= 1:
+            return load_tasks(
+                self.average_results, self.database_entry["N_runs"], [read_task_file(*args) for args in task_files]
+            )
+
+        with ThreadPoolExecutor(self.workers) as threads:
+            contents = list(threads.map(read_task_file, *zip(*task_files)))
+
+        with ProcessPoolExecutor(self.workers) as processes:
+            results = list(processes.map(
+                load_tasks,
+                repeat(self.average_results),
+                repeat(self.database_entry["N_runs"]),
+                [contents[i::self.workers] for i in range(self.workers)]
+            ))
+
+        running = {}
+        for finished_names, finished_task, running_i in results:
+            running.update(running_i)
+
+        return (
+            [name for finished_names, finished_task, running_i in results for name in finished_names],
+            tree_reduce([finished_task for finished_names, finished_task, running_i in results if finished_task is not None]),
+            running
+        )
+
     def update_folder(self):
-        self.dump()
-        if len(self.finished_task_files) > 1:
-            new_task_id = max(self.job_path.task_ids or [0]) + 100000
-            self.partial_task.save(self.job_path.data_path / f"{new_task_id}_task_output.json")
-            for f in self.finished_task_files:
-                f.unlink()
+        if self.changed or not (self.job_path / "output.json").exists():
+            self.dump()
+
+        if self.finished_task_files:
+            if self.state["partial_file"] is None and len(self.finished_task_files) == 1:
+                partial_file = self.finished_task_files[0]
+            else:
+                new_task_id = max(self.job_path.task_ids or [0]) + 100000
+                partial_file = self.job_path.data_path / f"{new_task_id}_task_output.json"
+                self.partial_task.save(partial_file)
+
+                if self.state["partial_file"] is not None:
+                    self.finished_task_files.append(self.job_path / self.state["partial_file"])
+                for f in self.finished_task_files:
+                    f.unlink()
+                    # nobody locks a finished task file anymore
+                    lock_file = f.with_name(f.name + ".lock")
+                    if lock_file.exists():
+                        lock_file.unlink()
+
+            self.state["partial_file"] = str(partial_file.relative_to(self.job_path.path))
+            self.state["partial_stat"] = file_stat(partial_file)
+
+        if self.changed:
+            self.save_state()
 
     def to_be_averaged(self, i):
         return self.average_results is not None and (self.average_results == 'all' or i in self.average_results)
@@ -69,8 +226,28 @@ class Gatherer:
                 ])
             })
 
+        if self.encoding == "npy":
+            self.dump_npy(output)
+        else:
+            with open(self.job_path / "output.json", 'w') as f:
+                json.dump(output, f, indent=2, cls=NumpyEncoder)
+
+    def dump_npy(self, output):
+        arrays_path = self.job_path.output_arrays_path
+        arrays_path.mkdir(exist_ok=True)
+        array_files = []
+
+        def add_blob(arr):
+            array_file = arrays_path / f"{len(array_files)}.npy"
+            save_npy(array_file, arr)
+            array_files.append(array_file)
+            return str(array_file.relative_to(self.job_path.path))
+
         with open(self.job_path / "output.json", 'w') as f:
-            json.dump(output, f, indent=2, cls=NumpyEncoder)
+            json.dump(output, f, indent=2, cls=NpyEncoder, add_blob=add_blob)
+
+        for array_file in set(arrays_path.iterdir()) - set(array_files):
+            array_file.unlink()
 
 
 def polish(x):
@@ -0,0 +1,198 @@
+"""
+Transfers the state of the interpreter (the globals of `__main__`) to the tasks of a job.
+
+save_interpreter_state=True:       the whole session is dumped, except for objects which cannot be pickled.
+save_interpreter_state="minimal":  only the globals which are reachable from the function are dumped.
+                                   They are found by walking the names referenced by its code, its closure and
+                                   default arguments, and transitively those of all functions and classes of
+                                   `__main__` as well as the attributes of all instances found along the way.
+
+In both cases, large arrays can be shared between the tasks via memory-mapped files, see `shared_arrays`.
+"""
+
+import __main__ as _main_module
+from .shared_arrays import SharedArray, SpillingPickler, SharingUnpickler, resolve_shared_arrays
+from types import FunctionType, MethodType, CodeType, ModuleType
+import pickle
+import dill
+import io
+
+
+def referenced_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, CodeType):
+            names |= referenced_names(const)
+    return names
+
+
+def reachable_globals(function, namespace=None):
+    """returns the names of all globals of `namespace` (default: `__main__`) which are reachable from `function`"""
+
+    namespace = vars(_main_module) if namespace is None else namespace
+    names = set()
+    visited = set()
+    stack = [function]
+
+    while stack:
+        obj = stack.pop()
+        if id(obj) in visited:
+            continue
+        visited.add(id(obj))
+
+        if isinstance(obj, MethodType):
+            stack.append(obj.__func__)
+            stack.append(obj.__self__)
+        elif isinstance(obj, FunctionType):
+            if obj.__globals__ is not namespace:
+                # functions of other modules are pickled by reference
+                continue
+
+            for name in referenced_names(obj.__code__):
+                if name in namespace and name not in names:
+                    names.add(name)
+                    stack.append(namespace[name])
+            stack.extend(cell.cell_contents for cell in (obj.__closure__ or ()) if cell_is_set(cell))
+            stack.extend(obj.__defaults__ or ())
+            stack.extend((obj.__kwdefaults__ or {}).values())
+        elif isinstance(obj, type):
+            if obj.__module__ != namespace.get("__name__"):
+                continue
+
+            stack.extend(obj.__bases__)
+            for attribute in vars(obj).values():
+                if isinstance(attribute, (staticmethod, classmethod)):
+                    stack.append(attribute.__func__)
+                elif isinstance(attribute, property):
+                    stack.extend(f for f in (attribute.fget, attribute.fset, attribute.fdel) if f is not None)
+                elif isinstance(attribute, FunctionType):
+                    stack.append(attribute)
+        elif isinstance(obj, (list, tuple, set, frozenset)):
+            stack.extend(obj)
+        elif isinstance(obj, dict):
+            stack.extend(obj.values())
+        elif not isinstance(obj, ModuleType):
+            # the attributes of an instance may hold functions or instances of `__main__` as well
+            stack.append(type(obj))
+            stack.extend(instance_attributes(obj))
+
+    return names
+
+
+def instance_attributes(obj):
+    attributes = getattr(obj, "__dict__", None)
+    if isinstance(attributes, dict):
+        yield from attributes.values()
+
+    for cls in type(obj).__mro__:
+        slots = vars(cls).get("__slots__", ())
+        for slot in [slots] if isinstance(slots, str) else slots:
+            if slot not in ("__dict__", "__weakref__") and hasattr(obj, slot):
+                yield getattr(obj, slot)
+
+
+def cell_is_set(cell):
+    try:
+        cell.cell_contents
+        return True
+    except ValueError:
+        return False
+
+
+def format_size(size):
+    for unit in ["B", "kB", "MB", "GB"]:
+        if size < 1000 or unit == "GB":
+            return f"{size:.3g} {unit}"
+        size /= 1000
+
+
+def dump_minimal_state(function, shared_arrays=None):
+    """
+    pickles the reachable globals one after another with a single pickler, whose memo keeps objects shared between
+    globals shared after loading. A global which cannot be pickled is cut off again and skipped.
+    """
+
+    f = io.BytesIO()
+    pickler = SpillingPickler(f, shared_arrays) if shared_arrays is not None else dill.Pickler(f)
+    sizes = {}
+    for name in sorted(reachable_globals(function)):
+        start = f.tell()
+        memo_size = len(pickler.memo)
+        try:
+            pickler.dump({name: _main_module.__dict__[name]})
+        except (pickle.PicklingError, TypeError):
+            f.seek(start)
+            f.truncate()
+            for key in list(pickler.memo)[memo_size:]:
+                del pickler.memo[key]
+            continue
+        sizes[name] = f.tell() - start
+
+    largest = sorted(sizes, key=sizes.get, reverse=True)
+    print(
+        f"[ParallelAverage] captured {len(sizes)} globals of the interpreter state "
+        f"({format_size(sum(sizes.values()))})" + (
+            ": " + ", ".join(f"{name} ({format_size(sizes[name])})" for name in largest[:10]) +
+            (", ..." if len(largest) > 10 else "")
+            if largest else ""
+        )
+    )
+    return f.getvalue()
+
+
+def dump_session(shared_arrays=None):
+    removed_objects = {}
+    shared_objects = {}
+    for name, obj in _main_module.__dict__.items():
+        if name in ("In", "Out") or (
+            name != "__name__" and name.startswith("_")
+        ):
+            removed_objects[name] = obj
+            continue
+
+        if shared_arrays is not None and shared_arrays.should_spill(obj):
+            shared_objects[name] = obj
+            continue
+
+        try:
+            dill.dumps(obj)
+        except (pickle.PicklingError, TypeError):
+            removed_objects[name] = obj
+
+    for name in removed_objects:
+        del _main_module.__dict__[name]
+    for name, obj in shared_objects.items():
+        _main_module.__dict__[name] = SharedArray(shared_arrays.spill(obj))
+
+    f = io.BytesIO()
+    try:
+        dill.dump_session(f, main=_main_module)
+    finally:
+        for name, obj in {**removed_objects, **shared_objects}.items():
+            _main_module.__dict__[name] = obj
+
+    return f.getvalue()
+
+
+def dump_interpreter_state(function, mode, shared_arrays=None):
+    """returns the serialized interpreter state"""
+
+    if mode == "minimal":
+        return dump_minimal_state(function, shared_arrays)
+    else:
+        return dump_session(shared_arrays)
+
+
+def load_interpreter_state(session_file, mode, blob_store, main=None):
+    """loads the interpreter state of a job into `main` (default: `__main__`)"""
+
+    namespace = vars(main or _main_module)
+    if mode == "minimal":
+        with open(session_file, 'rb') as f:
+            unpickler = SharingUnpickler(f, blob_store)
+            # one pickle per global, see `dump_minimal_state`
+            while f.peek(1):
+                namespace.update(unpickler.load())
+    else:
+        dill.load_session(str(session_file), main=main)
+        resolve_shared_arrays(namespace, blob_store)
@@ -1,10 +1,12 @@
+import hashlib
 import json
+import os
 import numpy as np
 
 
 class NumpyEncoder(json.JSONEncoder):
     def default(self, obj):
-        if type(obj) is np.ndarray:
+        if isinstance(obj, np.ndarray):
             output = {
                 "type": "ndarray",
                 "dtype": str(obj.dtype),
@@ -21,9 +23,55 @@ class NumpyEncoder(json.JSONEncoder):
         return super().default(obj)
 
 
+class NpyEncoder(NumpyEncoder):
+    """Stores arrays as binary .npy blobs via `add_blob` and only puts a reference into the json-skeleton."""
+
+    def __init__(self, *args, add_blob, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.add_blob = add_blob
+
+    def default(self, obj):
+        if isinstance(obj, np.ndarray) and not obj.dtype.hasobject:
+            return {
+                "type": "npy",
+                "blob": self.add_blob(obj)
+            }
+
+        return super().default(obj)
+
+
+class FingerprintEncoder(NumpyEncoder):
+    """Replaces arrays of at least `threshold` bytes by their fingerprint."""
+
+    def __init__(self, *args, threshold, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.threshold = threshold
+
+    def default(self, obj):
+        if isinstance(obj, np.ndarray) and not obj.dtype.hasobject and obj.nbytes >= self.threshold:
+            return fingerprint(obj)
+
+        return super().default(obj)
+
+
+def fingerprint(arr):
+    """stable content hash plus metadata of an array"""
+
+    sha1 = hashlib.sha1(f"{arr.dtype.str}{arr.shape}".encode())
+    sha1.update(np.ascontiguousarray(arr).data)
+
+    return {
+        "type": "fingerprint",
+        "sha1": sha1.hexdigest(),
+        "shape": list(arr.shape),
+        "dtype": str(arr.dtype)
+    }
+
+
 class NumpyDecoder(json.JSONDecoder):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, load_blob=None, **kwargs):
         super().__init__(object_hook=self.object_hook, *args, **kwargs)
+        self.load_blob = load_blob
 
     def object_hook(self, obj):
         if "type" in obj and obj["type"] == "ndarray":
@@ -35,4 +83,38 @@ class NumpyDecoder(json.JSONDecoder):
                 )
             return np.array(obj["data"], dtype=dtype)
 
+        if "type" in obj and obj["type"] == "npy" and self.load_blob is not None:
+            return self.load_blob(obj["blob"])
+
         return obj
+
+
+def save_npy(path, arr):
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, 'wb') as f:
+        np.lib.format.write_array(f, np.asanyarray(arr), allow_pickle=False)
+    # replace atomically, such that memory-maps of the previous version stay intact
+    os.replace(tmp_path, path)
+
+
+def load_npy(path, offset=0):
+    """memory-maps an array in .npy format, that starts at `offset` within the file at `path`"""
+
+    if offset == 0:
+        return np.load(path, mmap_mode="r")
+
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+
+        if not shape or 0 in shape:
+            f.seek(offset)
+            return np.lib.format.read_array(f, allow_pickle=False)
+
+        return np.memmap(
+            path, dtype=dtype, mode="r", offset=f.tell(), shape=shape, order="F" if fortran_order else "C"
+        )
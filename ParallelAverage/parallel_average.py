@@ -1,13 +1,17 @@
-from .prepare_submission import setup_task_input_data, setup_dynamic_load_balancing
-from .DatabaseEntry import DatabaseEntry, load_database
+from .prepare_submission import setup_task_input_data, setup_dynamic_load_balancing, save_session
+from .DatabaseEntry import DatabaseEntry, default_fingerprint_threshold
+from .database import open_database
 from .AveragedResult import load_averaged_result
 from .CollectiveResult import load_collective_result
 from .JobPath import JobPath
 from .re_submit import prepare_re_submission
-from .queuing_systems import slurm, local_machine
+from .progress import load_job_progress, format_job_progress
+from .scheduling import resolve_policy
+from .BlobStore import BlobStore, referenced_blobs
+from .shared_arrays import default_share_threshold
+from .queuing_systems import slurm, local_machine, local_pool
 
 import os
-import json
 import re
 from pathlib import Path
 from shutil import rmtree
@@ -22,13 +26,14 @@ action_argname = "__parallel_average_action__"
 # list of actions
 actions = namedtuple(
     "Actions",
-    "default do_submit dont_submit re_submit print_job_output cancel_job"
-)._make(range(6))
+    "default do_submit dont_submit re_submit print_job_output cancel_job print_job_progress"
+)._make(range(7))
 
 
 queuing_system_modules = {
     "Slurm": slurm,
-    None: local_machine
+    None: local_machine,
+    "local_pool": local_pool
 }
 
 
@@ -45,21 +50,41 @@ def largest_existing_job_index(parallel_average_path):
     return max(int(re.search(r"\d+", dir_str).group()) for dir_str in dirs_starting_with_a_number)
 
 
-def load_job_name(job_name, path=".", encoding="json"):
+def load_job_name(job_name, path=".", encoding="json", gather_workers=None):
     path = Path(path)
-    database_path = path / "parallel_average_database.json"
-    try:
-        entry = next(entry for entry in load_database(database_path) if entry["job_name"] == job_name)
-    except StopIteration:
+    database = open_database(path)
+    entry = database.find_job_name(job_name)
+    if entry is None:
         raise EntryDoesNotExist(f"'{job_name}' was not found in {path.resolve()}")
+    entry = DatabaseEntry(entry, database.path)
 
-    if entry.check_result():
+    if entry.check_result(gather_workers):
         if entry["average_results"] is None:
             return load_collective_result(entry, encoding)
         else:
             return load_averaged_result(entry, encoding)
 
 
+def job_progress(job_name, path="."):
+    """
+    returns the number of completed, failed and remaining runs of a job, as well as its current throughput
+    and estimated time to completion (in seconds), without gathering its results.
+    """
+
+    entry = DatabaseEntry.from_job_name(job_name, path)
+    return load_job_progress(entry.job_path.progress_path, volume(entry["N_runs"]))
+
+
+def job_lock_statistics(job_name, path="."):
+    """
+    returns the lock-wait statistics of all tasks of a job per kind of lock file, as of its last gathering.
+    Those of the calling process, which include gathering, are returned by `lock_statistics`.
+    """
+
+    entry = DatabaseEntry.from_job_name(job_name, path)
+    return entry.output.get("lock_statistics", {})
+
+
 def parallel_average(
     N_runs,
     N_tasks,
@@ -70,36 +95,48 @@ def parallel_average(
     encoding="json",
     path=".",
     queuing_system="Slurm",
+    database=None,
+    fingerprint_arguments=False,
+    gather_workers=None,
+    accumulator_dtype=None,
+    trace_memory=False,
+    workers_per_task=1,
+    share_arrays=False,
     **queuing_system_options
 ):
     if N_tasks == "max":
         N_tasks = volume(N_runs)
 
-    assert encoding in ["json", "pickle"]
-
-    def decorator(function):
-        @wraps(function)
-        def wrapper(*args, **kwargs):
-            action = kwargs.get(action_argname, actions.default)
-            if action_argname in kwargs:
-                del kwargs[action_argname]
+    if fingerprint_arguments is True:
+        fingerprint_threshold = default_fingerprint_threshold
+    elif fingerprint_arguments is False:
+        fingerprint_threshold = None
+    else:
+        fingerprint_threshold = fingerprint_arguments
 
-            assert volume(N_runs) >= 1, "'N_runs' has to be one or greater than one."
+    if share_arrays is True:
+        share_threshold = default_share_threshold
+    elif share_arrays is False:
+        share_threshold = None
+    else:
+        share_threshold = share_arrays
 
-            parallel_average_path = Path(path) / ".parallel_average"
-            parallel_average_path.mkdir(exist_ok=True)
-            database_path = Path(path) / "parallel_average_database.json"
-            database_path.touch()
+    assert encoding in ["json", "pickle", "npy"]
+    assert save_interpreter_state in [True, False, "minimal"]
+    dynamic_load_balancing = resolve_policy(dynamic_load_balancing)
 
+    def decorator(function):
+        def get_queuing_system_module():
             if queuing_system in queuing_system_modules:
-                queuing_system_module = queuing_system_modules[queuing_system]
+                return queuing_system_modules[queuing_system]
             else:
                 raise ValueError(
                     f"Unknown queuing system: {queuing_system}\n"
                     f"Supported options are: {list(queuing_system_modules)}"
                 )
 
-            new_entry = DatabaseEntry(
+        def make_entry(job_database, args, kwargs):
+            return DatabaseEntry(
                 dict(
                     function_name=function.__name__,
                     args=args,
@@ -107,13 +144,77 @@ def parallel_average(
                     N_runs=N_runs,
                     average_results=average_results
                 ),
-                database_path
+                job_database.path,
+                fingerprint_threshold
             )
 
-            if database_path.stat().st_size > 0:
-                try:
-                    entry = next(entry for entry in load_database(database_path) if entry == new_entry)
-                except StopIteration:
+        def load_result(entry):
+            if not entry.check_result(gather_workers):
+                return
+
+            if entry["average_results"] is None:
+                return load_collective_result(entry, encoding)
+            else:
+                return load_averaged_result(entry, encoding)
+
+        def check_job_parameters():
+            assert N_tasks <= volume(N_runs), "'N_tasks' has to be less than or equal to 'N_runs'."
+            assert N_tasks >= 1, "'N_tasks' has to be one or greater than one."
+            assert workers_per_task >= 1, "'workers_per_task' has to be one or greater than one."
+
+        def setup_job(job_path, args, kwargs, entry=None, session=None):
+            """writes the input of a new job and returns its number of tasks"""
+
+            if dynamic_load_balancing:
+                N_static_runs = setup_dynamic_load_balancing(
+                    N_runs, job_path.input_path, dynamic_load_balancing
+                )
+            else:
+                N_static_runs = None
+
+            if entry is not None:
+                run_ids_map = prepare_re_submission(entry, job_path, N_tasks)
+                num_tasks = len(run_ids_map)
+            else:
+                run_ids_map = None
+                num_tasks = N_tasks
+
+            setup_task_input_data(
+                job_path.path.name, job_path.input_path, N_runs, num_tasks, average_results, save_interpreter_state,
+                dynamic_load_balancing, N_static_runs, keep_runs,
+                function, args, kwargs, encoding, run_ids_map, accumulator_dtype,
+                trace_memory, workers_per_task, share_threshold, session
+            )
+
+            return num_tasks
+
+        def mark_as_running(new_entry, job_path):
+            new_entry.update(dict(
+                output=str((job_path / "output.json").relative_to(path)),
+                job_name=job_path.path.name,
+                status="running",
+                datetime=datetime.now().isoformat()
+            ))
+
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            action = kwargs.get(action_argname, actions.default)
+            if action_argname in kwargs:
+                del kwargs[action_argname]
+
+            assert volume(N_runs) >= 1, "'N_runs' has to be one or greater than one."
+
+            parallel_average_path = Path(path) / ".parallel_average"
+            parallel_average_path.mkdir(exist_ok=True)
+            job_database = open_database(path, database)
+            queuing_system_module = get_queuing_system_module()
+
+            new_entry = make_entry(job_database, args, kwargs)
+
+            entry = None
+            if not job_database.is_empty:
+                entry = new_entry.find_in_database()
+                if entry is None:
                     if action not in (actions.default, actions.do_submit):
                         best_fits_str = ""
                         for best_fit in new_entry.best_fitting_entries_in_database:
@@ -128,76 +229,110 @@ def parallel_average(
                     return queuing_system_module.print_job_output(
                         parallel_average_path / entry["job_name"]
                     )
+                elif action == actions.print_job_progress:
+                    progress = job_progress(entry["job_name"], path)
+                    print(format_job_progress(progress))
+                    return progress
                 elif action == actions.cancel_job:
-                    queuing_system_module.cancel_job(entry["job_name"])
+                    queuing_system_module.cancel_job(entry["job_name"], parallel_average_path / entry["job_name"])
                     entry.remove()
                     cleanup(path=path)
                     return
                 elif action == actions.re_submit:
-                    entry.check_result()
+                    entry.check_result(gather_workers)
                     if len(entry.output["successful_runs"]) == volume(entry["N_runs"]):
                         raise ValueError("All runs have finished successfully. No need for re-submitting job.")
-                    queuing_system_module.cancel_job(entry["job_name"])
-                elif action == actions.default and "entry" not in locals():
+                    queuing_system_module.cancel_job(entry["job_name"], parallel_average_path / entry["job_name"])
+                elif action == actions.default and entry is None:
                     pass
                 elif action == actions.do_submit:
-                    try:
-                        queuing_system_module.cancel_job(entry["job_name"])
+                    if entry is not None:
+                        queuing_system_module.cancel_job(
+                            entry["job_name"], parallel_average_path / entry["job_name"]
+                        )
                         entry.remove()
-                    except NameError:
-                        pass
                 else:
-                    if not entry.check_result():
-                        return
-
-                    if entry["average_results"] is None:
-                        return load_collective_result(entry, encoding)
-                    else:
-                        return load_averaged_result(entry, encoding)
+                    return load_result(entry)
 
             if action not in (actions.default, actions.do_submit, actions.re_submit):
                 raise EntryDoesNotExist()
 
-            assert N_tasks <= volume(N_runs), "'N_tasks' has to be less than or equal to 'N_runs'."
-            assert N_tasks >= 1, "'N_tasks' has to be one or greater than one."
+            check_job_parameters()
 
             job_index = (largest_existing_job_index(parallel_average_path) or 0) + 1
             job_name = f"{job_index}_{function.__name__}"
             job_path = JobPath(parallel_average_path / job_name)
 
-            if dynamic_load_balancing:
-                N_static_runs = setup_dynamic_load_balancing(N_runs, N_tasks, job_path.input_path)
-            else:
-                N_static_runs = None
-
-            if action == actions.re_submit:
-                run_ids_map = prepare_re_submission(entry, job_path, N_tasks)
-                num_tasks = len(run_ids_map)
-            else:
-                run_ids_map = None
-                num_tasks = N_tasks
-
-            setup_task_input_data(
-                job_name, job_path.input_path, N_runs, num_tasks, average_results, save_interpreter_state,
-                dynamic_load_balancing, N_static_runs, keep_runs,
-                function, args, kwargs, encoding, run_ids_map
-            )
+            num_tasks = setup_job(job_path, args, kwargs, entry if action == actions.re_submit else None)
 
             queuing_system_module.submit(
                 num_tasks, job_name, job_path, queuing_system_options
             )
 
-            new_entry.update(dict(
-                output=str((job_path / "output.json").relative_to(path)),
-                job_name=job_name,
-                status="running",
-                datetime=datetime.now().isoformat()
-            ))
+            mark_as_running(new_entry, job_path)
             new_entry.save()
 
             if action in (actions.do_submit, actions.re_submit):
                 cleanup(path=path)
 
+        def sweep(parameter_sets, *args, **kwargs):
+            """
+            Calls the function for each parameter set, a dict of keyword arguments which extends `args` and `kwargs`.
+            The jobs of all parameter sets which are not yet in the database are submitted together as a single
+            job-array and share one dump of the interpreter state. Nevertheless, each parameter set gets its own
+            database entry, such that a later normal call with the same arguments finds its result.
+
+            Returns the list of results, which are None for jobs that have not finished yet.
+            """
+
+            assert volume(N_runs) >= 1, "'N_runs' has to be one or greater than one."
+
+            parallel_average_path = Path(path) / ".parallel_average"
+            parallel_average_path.mkdir(exist_ok=True)
+            job_database = open_database(path, database)
+            queuing_system_module = get_queuing_system_module()
+
+            database_is_empty = job_database.is_empty
+            entries = []
+            # new entries and the keyword arguments of their parameter sets
+            new_jobs = []
+            for parameter_set in parameter_sets:
+                job_kwargs = {**kwargs, **parameter_set}
+                new_entry = make_entry(job_database, args, job_kwargs)
+                entry = None if database_is_empty else new_entry.find_in_database()
+                if entry is None:
+                    entry = next((e for e, _ in new_jobs if e == new_entry), None)
+                if entry is None:
+                    entry = new_entry
+                    new_jobs.append((new_entry, job_kwargs))
+                entries.append(entry)
+
+            if new_jobs:
+                check_job_parameters()
+
+                session = save_session(
+                    BlobStore(parallel_average_path), function, save_interpreter_state, share_threshold
+                )
+                job_index = (largest_existing_job_index(parallel_average_path) or 0) + 1
+                job_paths = []
+                for i, (new_entry, job_kwargs) in enumerate(new_jobs):
+                    job_path = JobPath(parallel_average_path / f"{job_index + i}_{function.__name__}")
+                    setup_job(job_path, args, job_kwargs, session=session)
+                    job_paths.append(job_path)
+
+                queuing_system_module.submit_sweep(
+                    N_tasks, f"{job_index}_{function.__name__}_sweep", job_paths, queuing_system_options
+                )
+
+                for (new_entry, _), job_path in zip(new_jobs, job_paths):
+                    mark_as_running(new_entry, job_path)
+                job_database.save_all(new_entry for new_entry, _ in new_jobs)
+
+                return [None if any(entry is e for e, _ in new_jobs) else load_result(entry) for entry in entries]
+
+            return [load_result(entry) for entry in entries]
+
+        wrapper.sweep = sweep
         return wrapper
     return decorator
 
@@ -210,6 +345,12 @@ def parallel(
     encoding="json",
     path=".",
     queuing_system="Slurm",
+    database=None,
+    fingerprint_arguments=False,
+    gather_workers=None,
+    trace_memory=False,
+    workers_per_task=1,
+    share_arrays=False,
     **queuing_system_options
 ):
     """Decorator for
@@ -225,6 +366,12 @@ def parallel(
             encoding=encoding,
             path=path,
             queuing_system=queuing_system,
+            database=database,
+            fingerprint_arguments=fingerprint_arguments,
+            gather_workers=gather_workers,
+            trace_memory=trace_memory,
+            workers_per_task=workers_per_task,
+            share_arrays=share_arrays,
             **queuing_system_options
         )(function)
 
@@ -267,6 +414,15 @@ def print_job_output(wrapper):
     return f
 
 
+def print_job_progress(wrapper):
+    @wraps(wrapper)
+    def f(*args, **kwargs):
+        kwargs[action_argname] = actions.print_job_progress
+        return wrapper(*args, **kwargs)
+
+    return f
+
+
 def cancel_job(wrapper):
     @wraps(wrapper)
     def f(*args, **kwargs):
@@ -282,24 +438,23 @@ def cleanup(
     path="."
 ):
     parallel_average_path = Path(path) / ".parallel_average"
-    database_path = Path(path) / "parallel_average_database.json"
-    if not database_path.exists() or database_path.stat().st_size == 0:
+    database = open_database(path)
+    if database.is_empty:
         return
 
-    with open(database_path, "r+") as f:
-        database_json = json.load(f)
-        if remove_running_jobs:
-            database_json = [
-                average for average in database_json if (
-                    "status" not in average or average["status"] == "completed"
-                )
-            ]
-            f.seek(0)
-            json.dump(database_json, f, indent=2)
-            f.truncate()
+    database_entries = database.load()
+    if remove_running_jobs:
+        database.remove_all(
+            average for average in database_entries if "status" in average and average["status"] != "completed"
+        )
+        database_entries = [
+            average for average in database_entries if (
+                "status" not in average or average["status"] == "completed"
+            )
+        ]
 
     if remove_intermediate_files_of_completed_jobs:
-        completed_jobs = [average for average in database_json if average["status"] == "completed"]
+        completed_jobs = [average for average in database_entries if average["status"] == "completed"]
         for average in completed_jobs:
             job_dir = parallel_average_path / average["job_name"]
             dirs_starting_with_a_number = [
@@ -313,13 +468,17 @@ def cleanup(
             for out_file in out_files:
                 out_file.unlink()
 
-    database_jobs = {average["job_name"] for average in database_json}
-    existing_jobs = {job.name for job in parallel_average_path.iterdir() if job.is_dir()}
+    database_jobs = {average["job_name"] for average in database_entries}
+    existing_jobs = {
+        job.name for job in parallel_average_path.iterdir() if job.is_dir() and job.name != BlobStore.dir_name
+    }
     bad_jobs = existing_jobs - database_jobs
 
     for bad_job in bad_jobs:
         rmtree(str(parallel_average_path / bad_job))
 
+    BlobStore(parallel_average_path).collect_garbage(referenced_blobs(parallel_average_path))
+
 
 def plot_average(
     x, average, label=None, color=0, points=False, linestyle="-", alpha=None, marker=None, cmap="CMRmap_r",
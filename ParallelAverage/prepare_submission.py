@@ -1,7 +1,11 @@
-import __main__ as _main_module
+from .AtomicCounter import AtomicCounter
+from .scheduling import static_runs
+from .interpreter_state import dump_interpreter_state
+from .BlobStore import BlobStore
+from .shared_arrays import SharedArrays
 import dill
-import pickle
 import json
+import os
 
 
 def setup_task_input_data(
@@ -18,9 +22,33 @@ def setup_task_input_data(
     args,
     kwargs,
     encoding,
-    run_ids_map
+    run_ids_map,
+    accumulator_dtype=None,
+    trace_memory=False,
+    workers_per_task=1,
+    share_threshold=None,
+    session=None
 ):
-    with (input_path / "run_task_arguments.json").open('w') as f:
+    # the session and the function are stored in the blob store of the project, to which the job only refers
+    blob_store = BlobStore(input_path.parent.parent)
+    if session is None:
+        session = save_session(blob_store, function, save_interpreter_state, share_threshold)
+    session_blob, session_array_blobs = session
+
+    shared_arrays = SharedArrays(blob_store, share_threshold) if share_threshold is not None else None
+    run_task_data = (shared_arrays.dumps if shared_arrays is not None else dill.dumps)(
+        {
+            "function": function,
+            "args": args,
+            "kwargs": kwargs
+        }
+    )
+
+    # written to a temporary file first, such that a concurrent `cleanup` never reads a truncated file
+    # and hence never misses the blobs referred to by this job
+    parameters_path = input_path / "run_task_arguments.json"
+    tmp_parameters_path = input_path / f"run_task_arguments.json.{os.getpid()}.tmp"
+    with tmp_parameters_path.open('w') as f:
         json.dump(
             {
                 "job_name": job_name,
@@ -33,54 +61,42 @@ def setup_task_input_data(
                 "keep_runs": keep_runs,
                 "encoding": encoding,
                 "new_task_ids": list(run_ids_map) if run_ids_map is not None else None,
-                "run_ids_map": run_ids_map
+                "run_ids_map": run_ids_map,
+                "accumulator_dtype": accumulator_dtype,
+                "trace_memory": trace_memory,
+                "workers_per_task": workers_per_task,
+                "session_blob": session_blob,
+                "run_task_blob": blob_store.put(run_task_data),
+                "array_blobs": sorted(
+                    set(session_array_blobs) | (shared_arrays.keys if shared_arrays is not None else set())
+                )
             },
             f,
             indent=2
         )
+    os.replace(tmp_parameters_path, parameters_path)
 
-    with (input_path / "run_task.d").open('wb') as f:
-        dill.dump(
-            {
-                "function": function,
-                "args": args,
-                "kwargs": kwargs
-            },
-            f
-        )
 
-    if save_interpreter_state:
-        removed_objects = {}
-        for name, obj in _main_module.__dict__.items():
-            if name in ("In", "Out") or (
-                name != "__name__" and name.startswith("_")
-            ):
-                removed_objects[name] = obj
-                continue
-
-            try:
-                dill.dumps(obj)
-            except (pickle.PicklingError, TypeError):
-                removed_objects[name] = obj
-
-        for name in removed_objects:
-            del _main_module.__dict__[name]
-
-        dill.dump_session(str(input_path / "session.pkl"), main=_main_module)
-
-        for name, obj in removed_objects.items():
-            _main_module.__dict__[name] = obj
-
-
-def setup_dynamic_load_balancing(N_runs, N_tasks, input_path):
-    N_runs = volume(N_runs)
-    N_static_runs = N_runs // 4
-    N_dynamic_runs = N_runs - N_static_runs
-    chunk_size = max(1, N_dynamic_runs // 3 // N_tasks)
-    dynamic_slices = list(range(N_static_runs, N_runs, chunk_size)) + [N_runs]
-    chunks = list(zip(dynamic_slices[:-1], dynamic_slices[1:]))
-    with (input_path / "chunks.json").open('w') as f:
-        json.dump(chunks, f)
+def save_session(blob_store, function, save_interpreter_state, share_threshold=None):
+    """
+    stores the interpreter state in `blob_store` and returns its key, together with the keys of its shared arrays.
+    The jobs of a sweep are given the result of a single call, such that the session is only dumped once.
+    """
+
+    if not save_interpreter_state:
+        return None, []
+
+    shared_arrays = SharedArrays(blob_store, share_threshold) if share_threshold is not None else None
+    session_data = dump_interpreter_state(function, save_interpreter_state, shared_arrays)
+
+    return blob_store.put(session_data), sorted(shared_arrays.keys) if shared_arrays is not None else []
+
+
+def setup_dynamic_load_balancing(N_runs, input_path, policy):
+    N_static_runs = static_runs(policy, volume(N_runs))
+
+    # tasks claim their next chunk by advancing this counter, which holds the first unclaimed run
+    AtomicCounter.create(input_path / "run_counter", N_static_runs)
 
     return N_static_runs
 
@@ -0,0 +1,96 @@
+"""
+Each task keeps counters of its finished runs, which are flushed periodically to a small file `progress/{task_id}.json`
+of the job directory. Reading the progress of a job only involves these files and never triggers a gather.
+"""
+
+from datetime import timedelta
+import json
+import time
+import os
+
+
+flush_interval = 5
+
+
+class TaskProgress:
+    """
+    `carried_over` marks the runs taken over from a previous job by a re-submission,
+    which were not executed in the time this progress spans and hence do not count towards the rate.
+    """
+
+    def __init__(self, progress_path, task_id, carried_over=False):
+        self.file = progress_path / f"{task_id}.json"
+        self.started = time.time()
+        self.last_flush = 0
+        self.carried_over = carried_over
+
+    def update(self, successful, failed, done=False):
+        if not done and time.time() - self.last_flush < flush_interval:
+            return
+
+        self.last_flush = time.time()
+        tmp_file = self.file.with_name(self.file.name + ".tmp")
+        with open(tmp_file, 'w') as f:
+            json.dump(
+                dict(
+                    successful=successful,
+                    failed=failed,
+                    started=self.started,
+                    updated=self.last_flush,
+                    done=done,
+                    carried_over=self.carried_over
+                ),
+                f
+            )
+        os.replace(tmp_file, self.file)
+
+
+def load_task_progress(progress_path):
+    """returns the last flushed progress of each task, keyed by task id"""
+
+    tasks = {}
+    for progress_file in progress_path.glob("*.json"):
+        try:
+            with open(progress_file) as f:
+                tasks[int(progress_file.stem)] = json.load(f)
+        except (OSError, ValueError):
+            continue
+
+    return tasks
+
+
+def task_rate(task):
+    duration = task["updated"] - task["started"]
+    return (task["successful"] + task["failed"]) / duration if duration > 0 else 0
+
+
+def load_job_progress(progress_path, N_total_runs):
+    tasks = list(load_task_progress(progress_path).values())
+
+    completed = sum(task["successful"] for task in tasks)
+    failed = sum(task["failed"] for task in tasks)
+    remaining = max(N_total_runs - completed - failed, 0)
+
+    running_tasks = [task for task in tasks if not task["done"]]
+    executed_tasks = [task for task in tasks if not task.get("carried_over", False)]
+    runs_per_second = sum(task_rate(task) for task in (running_tasks or executed_tasks))
+
+    return dict(
+        completed=completed,
+        failed=failed,
+        remaining=remaining,
+        running_tasks=len(running_tasks),
+        runs_per_second=runs_per_second,
+        eta=remaining / runs_per_second if remaining and runs_per_second > 0 else (0 if not remaining else None)
+    )
+
+
+def format_job_progress(progress):
+    eta = progress["eta"]
+    return (
+        f"[ParallelAverage] completed: {progress['completed']}, failed: {progress['failed']}, "
+        f"remaining: {progress['remaining']} runs\n"
+        f"[ParallelAverage] {progress['running_tasks']} running tasks, "
+        f"{progress['runs_per_second']:.3g} runs/s, "
+        f"ETA: {timedelta(seconds=round(eta)) if eta is not None else 'unknown'}"
+    )
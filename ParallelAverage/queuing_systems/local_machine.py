@@ -1,15 +1,49 @@
-from multiprocessing import Process, set_start_method, get_start_method
-from subprocess import run, STDOUT
+"""
+Runs the tasks of a job as processes on the local machine. At most `max_concurrent` tasks are running at any time,
+further tasks are started as soon as running ones finish.
+The tasks are started by a scheduler process in its own session, which keeps running when the submitting process exits.
+Each task runs in a session of its own as well and its pid is kept in `<task_id>.pid` while it is running, such that
+cancelling a job (also before re-submitting it) kills the running tasks including their workers. Once a job is marked
+as cancelled, the scheduler does not start any further tasks of it.
+
+Options (passed like any other queuing system option):
+    max_concurrent:     maximal number of concurrently running tasks
+                        (default: number of available cpus divided by `workers_per_task`)
+    pin_cores:          if True, each task is pinned to its own set of cores via `os.sched_setaffinity` (Linux only)
+    blas_threads:       number of threads of BLAS/OpenMP libraries per task.
+                        By default, the available cpus are divided among the concurrent tasks,
+                        unless the corresponding environment variables are already set.
+    python_executable:  default: python
+"""
+
+from ..simpleflock import SimpleFlock
+from subprocess import Popen, STDOUT, DEVNULL
 from pathlib import Path
+import signal
+import json
 import os
 
 
 package_path = Path(os.path.abspath(__file__)).parent.parent
 
+blas_thread_variables = [
+    "OMP_NUM_THREADS",
+    "OPENBLAS_NUM_THREADS",
+    "MKL_NUM_THREADS",
+    "VECLIB_MAXIMUM_THREADS",
+    "NUMEXPR_NUM_THREADS"
+]
+
+
+def available_cpus():
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count()))
+
 
-def run_task(python, task_id, job_path):
+def start_task(python, task_id, job_path, env, cores):
     with open(job_path / f"{task_id}.out", 'w') as f:
-        run(
+        process = Popen(
             [
                 python,
                 f"{package_path}/run_task.py",
@@ -18,23 +52,128 @@ def run_task(python, task_id, job_path):
             ],
             stdout=f,
             stderr=STDOUT,
-            cwd=str(job_path.resolve())
+            cwd=str(job_path.resolve()),
+            env=env,
+            start_new_session=True
+        )
+
+    if cores is not None:
+        try:
+            os.sched_setaffinity(process.pid, cores)
+        except ProcessLookupError:
+            pass
+
+    return process
+
+
+def run_tasks(schedule_path):
+    with open(schedule_path, 'r') as f:
+        schedule = json.load(f)
+
+    python = schedule["python"]
+    max_concurrent = schedule["max_concurrent"]
+    cores_per_task = schedule["cores_per_task"]
+    tasks = [(Path(job_path), task_id) for job_path, task_id in schedule["tasks"]]
+
+    cpus = available_cpus()
+    free_core_sets = [
+        cpus[i * cores_per_task: (i + 1) * cores_per_task] for i in range(len(cpus) // cores_per_task)
+    ] if schedule["pin_cores"] else []
+    # pid -> (core set, pid file)
+    running = {}
+
+    def finished(pid):
+        core_set, pid_path = running.pop(pid)
+        if core_set is not None:
+            free_core_sets.append(core_set)
+        pid_path.unlink(missing_ok=True)
+
+    for job_path, task_id in tasks:
+        while len(running) >= max_concurrent:
+            pid, status = os.wait()
+            if pid in running:
+                finished(pid)
+
+        try:
+            with SimpleFlock(str(job_path / "scheduler.lock")):
+                if (job_path / "cancelled").exists():
+                    continue
+
+                core_set = free_core_sets.pop(0) if free_core_sets else None
+                process = start_task(python, task_id, job_path, os.environ, core_set)
+                pid_path = job_path / f"{task_id}.pid"
+                pid_path.write_text(str(process.pid))
+                running[process.pid] = core_set, pid_path
+        except FileNotFoundError:
+            # the job has been removed
+            continue
+
+    for pid in list(running):
+        os.waitpid(pid, 0)
+        finished(pid)
+
+
+def start_scheduler(tasks, name, workers_per_task, user_options):
+    N_cpus = len(available_cpus())
+    max_concurrent = user_options.get("max_concurrent", max(1, N_cpus // workers_per_task))
+    cores_per_task = max(1, N_cpus // min(max_concurrent, len(tasks)))
+    pin_cores = user_options.get("pin_cores", False) and hasattr(os, "sched_setaffinity")
+    python = user_options.get("python_executable", "python")
+
+    env = dict(os.environ)
+    blas_threads = user_options.get("blas_threads")
+    for variable in blas_thread_variables:
+        if blas_threads is not None:
+            env[variable] = str(blas_threads)
+        else:
+            env.setdefault(variable, str(max(1, cores_per_task // workers_per_task)))
+
+    # the schedule lives next to the tasks, the command line would be too short for large sweeps
+    schedule_path = tasks[0][0].resolve() / "schedule.json"
+    with open(schedule_path, 'w') as f:
+        json.dump(
+            dict(
+                python=python,
+                tasks=[(str(job_path.resolve()), task_id) for job_path, task_id in tasks],
+                max_concurrent=max_concurrent,
+                cores_per_task=cores_per_task,
+                pin_cores=pin_cores
+            ),
+            f
+        )
+
+    # the scheduler runs in its own session, such that it outlives the submitting process
+    with open(schedule_path.parent / "scheduler.log", 'w') as log:
+        scheduler = Popen(
+            [
+                python,
+                "-c",
+                "from ParallelAverage.queuing_systems.local_machine import run_tasks; "
+                f"run_tasks({str(schedule_path)!r})"
+            ],
+            stdin=DEVNULL,
+            stdout=log,
+            stderr=log,
+            env=env,
+            start_new_session=True
         )
+    (schedule_path.parent / "scheduler.pid").write_text(str(scheduler.pid))
+
+    print(
+        f"[ParallelAverage] starting {len(tasks)} local processes, at most {min(max_concurrent, len(tasks))} at a time",
+        name
+    )
 
 
 def submit(N_tasks, job_name, job_path, user_options):
-    if get_start_method() != "spawn":
-        set_start_method("spawn", force=True)
+    tasks = [(job_path, task_id) for task_id in range(1, N_tasks + 1)]
+    start_scheduler(tasks, job_name, job_path.parameters.get("workers_per_task", 1), user_options)
 
-    for task_id in range(1, N_tasks + 1):
-        Process(
-            name=job_name + f"_{task_id}",
-            target=run_task,
-            args=(user_options.get("python_executable", "python"), task_id, job_path),
-            daemon=True
-        ).start()
 
-    print(f"[ParallelAverage] starting {N_tasks} local processes", job_name)
+def submit_sweep(N_tasks, sweep_name, job_paths, user_options):
+    # the tasks of all jobs share one scheduler, such that the bound on concurrent tasks holds for the whole sweep
+    tasks = [(job_path, task_id) for job_path in job_paths for task_id in range(1, N_tasks + 1)]
+    start_scheduler(tasks, sweep_name, job_paths[0].parameters.get("workers_per_task", 1), user_options)
 
 
 def print_job_output(job_path):
@@ -47,5 +186,35 @@ def print_job_output(job_path):
         )
 
 
-def cancel_job(job_name):
-    print("[ParallelAverage] cancelling a process on the local machine is not yet supported. Please do manually.")
+def kill_session(pid):
+    """terminates the session led by `pid`, unless the process is gone and its pid has been reused"""
+
+    try:
+        if os.getsid(pid) == pid:
+            os.killpg(pid, signal.SIGTERM)
+    except ProcessLookupError:
+        pass
+
+
+def cancel_job(job_name, job_path):
+    job_path = Path(job_path)
+    if not job_path.exists():
+        return
+
+    with SimpleFlock(str(job_path / "scheduler.lock")):
+        (job_path / "cancelled").touch()
+
+        for pid_path in job_path.glob("*.pid"):
+            if pid_path.stem.isdigit():
+                kill_session(int(pid_path.read_text()))
+
+        # a scheduler which runs only the tasks of this job has nothing left to do. That of a sweep keeps running the
+        # tasks of the other jobs.
+        scheduler_pid_path = job_path / "scheduler.pid"
+        if scheduler_pid_path.exists():
+            with open(job_path / "schedule.json", 'r') as f:
+                schedule = json.load(f)
+            if all(Path(task_job_path) == job_path.resolve() for task_job_path, task_id in schedule["tasks"]):
+                kill_session(int(scheduler_pid_path.read_text()))
+
+    print("[ParallelAverage] cancelling local processes", job_name)
@@ -0,0 +1,354 @@
+"""
+A local backend which keeps a pool of warm worker processes alive across jobs.
+
+The first submission starts a server process, which imports the heavy modules once and listens on a unix socket.
+Each worker is forked from the server and serves one job at a time: it loads the job's session and function once and
+then forks a fresh process for each task, which executes `run_task.py` without loading them again.
+A worker that is asked for a different job is replaced by a new fork of the server, such that sessions never mix.
+The server terminates itself after `idle_timeout` seconds without any task.
+
+Options (passed like any other queuing system option):
+    pool_workers:       maximal number of concurrently running tasks (default: number of cpus)
+    idle_timeout:       seconds until an idle server terminates (default: 600)
+    python_executable:  interpreter of the server (default: python)
+"""
+
+from ..simpleflock import SimpleFlock
+from ..interpreter_state import load_interpreter_state
+from ..BlobStore import BlobStore, job_input_files
+from .. import shared_arrays
+from .local_machine import print_job_output
+from multiprocessing.connection import wait
+from collections import deque
+from itertools import count
+from subprocess import Popen, DEVNULL
+from pathlib import Path
+import multiprocessing
+import traceback
+import tempfile
+import hashlib
+import signal
+import socket
+import struct
+import stat
+import json
+import time
+import sys
+import os
+
+
+package_path = Path(os.path.abspath(__file__)).parent.parent
+run_task_path = package_path / "run_task.py"
+
+
+def socket_dir():
+    """
+    returns a directory in the temporary directory that only the user can access. Whoever can connect to the socket
+    of a server can make it execute arbitrary code, hence the directory must not be created or replaced by others.
+    """
+
+    path = Path(tempfile.gettempdir()) / f"ParallelAverage-{os.getuid()}"
+    try:
+        path.mkdir(mode=0o700)
+    except FileExistsError:
+        pass
+
+    status = path.lstat()
+    if not stat.S_ISDIR(status.st_mode) or status.st_uid != os.getuid() or status.st_mode & 0o077:
+        raise PermissionError(
+            f"[ParallelAverage] {path} has to be a directory which is only accessible by its owner (you)."
+        )
+    return path
+
+
+def socket_path(parallel_average_path):
+    # unix socket paths are limited to about 100 characters, hence they are kept in the temporary directory
+    key = hashlib.sha1(str(Path(parallel_average_path).resolve()).encode()).hexdigest()[:16]
+    return socket_dir() / f"{key}.sock"
+
+
+def peer_uid(connection):
+    """returns the user id of the process on the other end of a unix socket, or None if the platform does not tell"""
+
+    if not hasattr(socket, "SO_PEERCRED"):
+        return None
+
+    credentials = connection.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, struct.calcsize("3i"))
+    pid, uid, gid = struct.unpack("3i", credentials)
+    return uid
+
+
+def send(parallel_average_path, message):
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(str(socket_path(parallel_average_path)))
+        client.sendall(json.dumps(message).encode() + b"\n")
+        return client.makefile().readline()
+    finally:
+        client.close()
+
+
+def start_server(parallel_average_path, user_options):
+    server_options = dict(
+        pool_workers=user_options.get("pool_workers", os.cpu_count()),
+        idle_timeout=user_options.get("idle_timeout", 600)
+    )
+    # `-c` keeps the `__main__` module of the server empty, which is where the sessions of the jobs are loaded into
+    with open(Path(parallel_average_path) / "local_pool.log", 'a') as log:
+        Popen(
+            [
+                user_options.get("python_executable", "python"),
+                "-c",
+                "from ParallelAverage.queuing_systems.local_pool import serve; "
+                f"serve({str(Path(parallel_average_path).resolve())!r}, **{server_options!r})"
+            ],
+            stdin=DEVNULL,
+            stdout=log,
+            stderr=log,
+            start_new_session=True
+        )
+
+
+def submit_jobs(N_tasks, job_paths, user_options):
+    parallel_average_path = job_paths[0].path.parent
+    messages = [
+        dict(submit=str(job_path.resolve()), task_ids=list(range(1, N_tasks + 1))) for job_path in job_paths
+    ]
+
+    with SimpleFlock(str(parallel_average_path / "local_pool.lock")):
+        try:
+            send(parallel_average_path, messages[0])
+        except (FileNotFoundError, ConnectionRefusedError):
+            start_server(parallel_average_path, user_options)
+            for attempt in range(200):
+                time.sleep(0.05)
+                try:
+                    send(parallel_average_path, messages[0])
+                    break
+                except (FileNotFoundError, ConnectionRefusedError):
+                    continue
+            else:
+                raise RuntimeError(
+                    f"[ParallelAverage] Could not start the local pool, see {parallel_average_path / 'local_pool.log'}"
+                )
+
+        for message in messages[1:]:
+            send(parallel_average_path, message)
+
+
+def submit(N_tasks, job_name, job_path, user_options):
+    submit_jobs(N_tasks, [job_path], user_options)
+
+    print(f"[ParallelAverage] submitting {N_tasks} tasks to the local pool", job_name)
+
+
+def submit_sweep(N_tasks, sweep_name, job_paths, user_options):
+    submit_jobs(N_tasks, job_paths, user_options)
+
+    print(f"[ParallelAverage] submitting {len(job_paths) * N_tasks} tasks to the local pool", sweep_name)
+
+
+def cancel_job(job_name, job_path):
+    try:
+        send(Path(job_path).parent, dict(cancel=job_name))
+    except (FileNotFoundError, ConnectionRefusedError):
+        pass
+
+    print("[ParallelAverage] cancelling tasks of the local pool", job_name)
+
+
+def preload_job(job_dir):
+    """loads the session and the function of a job into `__main__`, where `run_task.py` is going to find them"""
+
+    main = sys.modules["__main__"]
+    input_dir = Path(job_dir) / "input"
+    with open(input_dir / "run_task_arguments.json", 'r') as f:
+        parameters = json.load(f)
+
+    session_file, run_task_file = job_input_files(input_dir, parameters)
+    blob_store = BlobStore(Path(job_dir).parent)
+    if parameters["save_interpreter_state"]:
+        load_interpreter_state(session_file, parameters["save_interpreter_state"], blob_store, main)
+
+    vars(main)["run_task"] = shared_arrays.load(run_task_file, blob_store)
+
+    vars(main)["preloaded_job_dir"] = str(job_dir)
+
+
+def execute_task(job_dir, task_id):
+    """executes `run_task.py` in the namespace of `__main__`. Only called in a freshly forked process."""
+
+    with open(Path(job_dir) / f"{task_id}.out", 'w') as f:
+        os.dup2(f.fileno(), 1)
+        os.dup2(f.fileno(), 2)
+
+    exit_code = 0
+    try:
+        os.chdir(job_dir)
+        sys.argv = [str(run_task_path), str(task_id), job_dir]
+        code = compile(run_task_path.read_text(), str(run_task_path), "exec")
+        exec(code, vars(sys.modules["__main__"]))
+    except BaseException:
+        traceback.print_exc()
+        exit_code = 1
+    finally:
+        sys.stdout.flush()
+        sys.stderr.flush()
+        os._exit(exit_code)
+
+
+def worker(connection):
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    job = None
+
+    while True:
+        try:
+            message = connection.recv()
+        except EOFError:
+            return
+        if message is None:
+            return
+
+        next_job, task_id = message
+
+        if job is None:
+            try:
+                preload_job(next_job[0])
+            except Exception:
+                traceback.print_exc()
+            job = next_job
+        assert next_job == job
+
+        pid = os.fork()
+        if pid == 0:
+            connection.close()
+            execute_task(job[0], task_id)
+
+        connection.send(pid)
+        os.waitpid(pid, 0)
+        connection.send(None)
+
+
+class Server:
+    def __init__(self, parallel_average_path, pool_workers, idle_timeout):
+        self.parallel_average_path = parallel_average_path
+        self.pool_workers = pool_workers
+        self.idle_timeout = idle_timeout
+        self.context = multiprocessing.get_context("fork")
+        # a job is identified by its directory and the number of its submission, since a job directory can be reused
+        self.submissions = count()
+        self.queue = deque()
+        # connection -> [process, job, pid of the running task or None]
+        self.workers = {}
+        self.last_activity = time.time()
+
+    def start_worker(self):
+        connection, worker_connection = self.context.Pipe()
+        process = self.context.Process(target=worker, args=(worker_connection,))
+        process.start()
+        worker_connection.close()
+        self.workers[connection] = [process, None, None]
+        return connection
+
+    def stop_worker(self, connection):
+        process = self.workers.pop(connection)[0]
+        # other forked processes may hold copies of this pipe, hence it is not enough to close it
+        try:
+            connection.send(None)
+        except OSError:
+            pass
+        connection.close()
+        process.join()
+
+    def dispatch(self):
+        while self.queue:
+            job, task_id = self.queue[0]
+            idle = [c for c, (_, worker_job, pid) in self.workers.items() if pid is None]
+            same_job = [c for c in idle if self.workers[c][1] == job]
+            fresh = [c for c in idle if self.workers[c][1] is None]
+
+            if same_job or fresh:
+                connection = (same_job or fresh)[0]
+            elif len(self.workers) < self.pool_workers:
+                connection = self.start_worker()
+            elif idle:
+                # replace a worker which holds the session of another job
+                self.stop_worker(idle[0])
+                connection = self.start_worker()
+            else:
+                return
+
+            self.queue.popleft()
+            connection.send((job, task_id))
+            self.workers[connection][1] = job
+            self.workers[connection][2] = connection.recv()
+
+    def handle(self, client):
+        with client:
+            uid = peer_uid(client)
+            if uid is not None and uid != os.getuid():
+                print(f"[ParallelAverage] refused a connection of user {uid}", flush=True)
+                return
+
+            message = json.loads(client.makefile().readline())
+            if "submit" in message and Path(message["submit"]).parent != Path(self.parallel_average_path):
+                print(f"[ParallelAverage] refused to run {message['submit']} outside of this pool", flush=True)
+                client.sendall(b"refused\n")
+                return
+
+            if "submit" in message:
+                job = (message["submit"], next(self.submissions))
+                self.queue.extend((job, task_id) for task_id in message["task_ids"])
+            elif "cancel" in message:
+                job_dir = str(Path(self.parallel_average_path) / message["cancel"])
+                self.queue = deque((job, task_id) for job, task_id in self.queue if job[0] != job_dir)
+                for _, job, pid in self.workers.values():
+                    if job is not None and job[0] == job_dir and pid is not None:
+                        os.kill(pid, signal.SIGTERM)
+            client.sendall(b"ok\n")
+
+    @property
+    def busy(self):
+        return self.queue or any(pid is not None for _, _, pid in self.workers.values())
+
+    def serve(self):
+        path = socket_path(self.parallel_average_path)
+        if path.exists():
+            path.unlink()
+
+        listener = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        listener.bind(str(path))
+        os.chmod(path, 0o600)
+        listener.listen()
+
+        try:
+            while self.busy or time.time() - self.last_activity < self.idle_timeout:
+                for ready in wait([listener, *self.workers], timeout=1):
+                    if ready is listener:
+                        self.handle(listener.accept()[0])
+                    else:
+                        try:
+                            ready.recv()
+                            self.workers[ready][2] = None
+                        except EOFError:
+                            self.stop_worker(ready)
+                    self.last_activity = time.time()
+
+                self.dispatch()
+        finally:
+            listener.close()
+            path.unlink()
+            for connection in list(self.workers):
+                self.stop_worker(connection)
+
+
+def serve(parallel_average_path, pool_workers=None, idle_timeout=600):
+    # warm up: these imports are what a fresh `python run_task.py` spends most of its startup time on
+    import dill
+    import ParallelAverage
+    try:
+        import numpy
+    except ImportError:
+        pass
+
+    Server(parallel_average_path, pool_workers or os.cpu_count(), idle_timeout).serve()
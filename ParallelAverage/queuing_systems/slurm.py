@@ -1,5 +1,7 @@
 from pathlib import Path
 from subprocess import run
+import json
+import re
 import os
 
 
@@ -7,12 +9,35 @@ package_path = Path(os.path.abspath(__file__)).parent.parent
 config_path = Path.home() / ".config/ParallelAverage"
 
 
-def submit(N_tasks, job_name, job_path, user_options):
+def max_array_index():
+    """returns the largest array index this cluster accepts, which is MaxArraySize - 1, or None if it is unknown"""
+
+    try:
+        config = run(["scontrol", "show", "config"], capture_output=True, text=True).stdout
+    except FileNotFoundError:
+        return None
+
+    match = re.search(r"^MaxArraySize\s*=\s*(\d+)", config, re.MULTILINE)
+    return int(match.group(1)) - 1 if match else None
+
+
+def check_array_size(N_tasks, name, limit):
+    if limit is not None and N_tasks > limit:
+        raise ValueError(
+            f"[ParallelAverage] {name} has {N_tasks} tasks, but the job-arrays of this cluster have at most {limit} "
+            "tasks (MaxArraySize - 1). Please reduce N_tasks."
+        )
+
+
+def write_job_script(N_array, name, job_path, user_options):
     options = {
-        "array": f"1-{N_tasks}",
-        "job-name": job_name,
+        "array": f"1-{N_array}",
+        "job-name": name,
         "chdir": str(job_path.resolve()),
     }
+    workers_per_task = job_path.parameters.get("workers_per_task", 1)
+    if workers_per_task > 1:
+        options["cpus_per_task"] = workers_per_task
     options.update(user_options)
 
     options_str = ""
@@ -34,6 +59,11 @@ def submit(N_tasks, job_name, job_path, user_options):
     with (job_path / "job_script_slurm.sh").open('w') as f:
         f.write(job_script_slurm)
 
+
+def submit(N_tasks, job_name, job_path, user_options):
+    check_array_size(N_tasks, job_name, max_array_index())
+    write_job_script(N_tasks, job_name, job_path, user_options)
+
     run([
         "sbatch",
         f"{job_path}/job_script_slurm.sh",
@@ -43,6 +73,43 @@ def submit(N_tasks, job_name, job_path, user_options):
     print("[ParallelAverage] submitting job-array", job_name)
 
 
+def submit_sweep(N_tasks, sweep_name, job_paths, user_options):
+    """
+    submits the tasks of all jobs as a single job-array. Its script lives in the directory of the first job and
+    executes `run_sweep_task.py`, which maps each array index to a job and a task via `sweep.json`.
+    If the tasks exceed the largest array of the cluster, the jobs are split into several job-arrays, which are
+    submitted as sweeps of their own.
+    """
+
+    limit = max_array_index()
+    check_array_size(N_tasks, sweep_name, limit)
+    jobs_per_array = len(job_paths) if limit is None else limit // N_tasks
+    if jobs_per_array < len(job_paths):
+        for i in range(0, len(job_paths), jobs_per_array):
+            submit_sweep_array(
+                N_tasks, f"{sweep_name}_{i // jobs_per_array + 1}", job_paths[i: i + jobs_per_array], user_options
+            )
+    else:
+        submit_sweep_array(N_tasks, sweep_name, job_paths, user_options)
+
+
+def submit_sweep_array(N_tasks, sweep_name, job_paths, user_options):
+    sweep = dict(sweep_name=sweep_name, job_names=[job_path.path.name for job_path in job_paths], N_tasks=N_tasks)
+    for job_path in job_paths:
+        with (job_path / "sweep.json").open('w') as f:
+            json.dump(sweep, f, indent=2)
+
+    write_job_script(len(job_paths) * N_tasks, sweep_name, job_paths[0], user_options)
+
+    run([
+        "sbatch",
+        f"{job_paths[0]}/job_script_slurm.sh",
+        f"{package_path}/run_sweep_task.py"
+    ])
+
+    print(f"[ParallelAverage] submitting job-array of {len(job_paths)} jobs", sweep_name)
+
+
 def print_job_output(job_path):
     output_files = [f for f in job_path.iterdir() if str(f).endswith(".out")]
     largest_output_file = max(output_files, key=lambda f: f.stat().st_size)
@@ -53,10 +120,27 @@ def print_job_output(job_path):
         )
 
 
-def cancel_job(job_name):
-    run([
-        "scancel",
-        f"--jobname={job_name}"
-    ])
+def cancel_job(job_name, job_path):
+    sweep_file = Path(job_path) / "sweep.json"
+    if sweep_file.exists():
+        # only the array indices of this job are cancelled, the other jobs of the sweep keep running
+        with sweep_file.open() as f:
+            sweep = json.load(f)
+        offset = sweep["job_names"].index(job_name) * sweep["N_tasks"]
+        array_job_ids = run(
+            ["squeue", "--noheader", f"--name={sweep['sweep_name']}", "--format=%F"],
+            capture_output=True,
+            text=True
+        ).stdout.split()
+        for array_job_id in set(array_job_ids):
+            run([
+                "scancel",
+                f"{array_job_id}_[{offset + 1}-{offset + sweep['N_tasks']}]"
+            ])
+    else:
+        run([
+            "scancel",
+            f"--jobname={job_name}"
+        ])
 
     print("[ParallelAverage] cancelling job-array", job_name)
@@ -1,22 +1,23 @@
 from .gathering import Gatherer
+from .progress import TaskProgress
+from .RunSet import RunSet
 import shutil
 
 
 def prepare_re_submission(old_database_entry, new_job_path, num_new_tasks):
     """
     initializes `new_job_path` with successful runs from `old_database_entry` and
-    returns a dict mapping new task-ids to a list of assigned run-ids respectively
+    returns a dict mapping new task-ids to their assigned runs respectively
     """
     total_task = Gatherer(old_database_entry).run().total_task
 
-    run_ids = sorted(
-        set(range(old_database_entry["N_runs"])) -
-        {eval(run_id) for run_id in total_task.successful_runs}
-    )
-    total_task.failed_runs = []
+    run_ids = RunSet.full(old_database_entry["N_runs"]) - total_task.successful_runs
+    total_task.failed_runs = RunSet()
     total_task.error_message = {}
     total_task.done = True
     total_task.save(new_job_path.data_path / "1_task_output.json")
+    new_job_path.progress_path.mkdir(exist_ok=True)
+    TaskProgress(new_job_path.progress_path, 1, carried_over=True).update(len(total_task.successful_runs), 0, done=True)
 
     for raw_results in total_task.raw_results_files:
         shutil.copy(raw_results, new_job_path.data_path / raw_results.name)
@@ -25,6 +26,5 @@ def prepare_re_submission(old_database_entry, new_job_path, num_new_tasks):
     num_new_tasks = min(num_new_tasks, len(run_ids))
 
     return {
-        task_base + i: [run_ids[j] for j in range(i, len(run_ids), num_new_tasks)]
-        for i in range(num_new_tasks)
+        task_base + i: task_run_ids.to_json() for i, task_run_ids in enumerate(run_ids.split(num_new_tasks))
     }
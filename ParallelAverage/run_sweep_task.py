@@ -0,0 +1,35 @@
+"""
+This file executes a single task of a sweep, whose jobs are submitted together as a single job-array.
+It maps the array index to a job and a task of that job and then hands over to `run_task.py`.
+
+Command-line arguments
+======================
+
+1: array index, starting at 1
+2: working directory of the first job of the sweep, which contains `sweep.json`
+"""
+
+
+import os
+import sys
+import json
+from pathlib import Path
+
+
+array_index = int(sys.argv[1]) - 1
+sweep_dir = Path(sys.argv[2])
+
+with open(sweep_dir / "sweep.json", 'r') as f:
+    sweep = json.load(f)
+
+job_dir = sweep_dir.parent / sweep["job_names"][array_index // sweep["N_tasks"]]
+task_id = array_index % sweep["N_tasks"] + 1
+
+# the output of the task goes to its own job, where `print_job_output` is looking for it
+with open(job_dir / f"{task_id}.out", 'w') as f:
+    os.dup2(f.fileno(), 1)
+    os.dup2(f.fileno(), 2)
+
+os.chdir(job_dir)
+run_task_path = Path(os.path.abspath(__file__)).parent / "run_task.py"
+os.execv(sys.executable, [sys.executable, str(run_task_path), str(task_id), str(job_dir)])
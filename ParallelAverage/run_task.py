@@ -9,21 +9,28 @@ Command-line arguments
 
 1: task id
 2: working directory of job
+
+If `workers_per_task` is greater than one, the runs are executed in chunks by a pool of processes forked after the
+session has been loaded. Each worker averages the runs of its chunk, this process merges these partial averages.
 """
 
 
 import os
 import sys
 import json
-import dill
-import pickle
 import time as time_mod
-import random
 from collections import defaultdict
-from itertools import product
 from pathlib import Path
 import traceback
-from ParallelAverage import Dataset, SimpleFlock, volume, NumpyEncoder
+from ParallelAverage import Dataset, SampleBatch, SimpleFlock, lock_statistics, volume, NumpyEncoder
+from ParallelAverage.RawResultsFile import RawResultsFile
+from ParallelAverage.RunSet import RunSet, unravel_run_id
+from ParallelAverage.scheduling import ChunkScheduler
+from ParallelAverage.progress import TaskProgress
+from ParallelAverage.RunStatistics import RunStatistics
+from ParallelAverage.interpreter_state import load_interpreter_state
+from ParallelAverage.BlobStore import BlobStore, job_input_files
+from ParallelAverage.shared_arrays import load as load_with_shared_arrays
 
 
 task_id = int(sys.argv[1])
@@ -31,6 +38,8 @@ job_dir = Path(sys.argv[2])
 data_dir = job_dir / "data_output"
 data_dir.mkdir(exist_ok=True)
 input_dir = job_dir / "input"
+progress_dir = job_dir / "progress"
+progress_dir.mkdir(exist_ok=True)
 
 
 to_be_averaged = lambda i: average_results is not None and (average_results == 'all' or i in average_results)
@@ -39,8 +48,14 @@ to_be_averaged = lambda i: average_results is not None and (average_results == '
 with open(input_dir / "run_task_arguments.json", 'r') as f:
     parameters = json.load(f)
 
-if parameters["save_interpreter_state"]:
-    dill.load_session(str(input_dir / "session.pkl"))
+# a worker of the local pool has already loaded the session and the function of its job
+preloaded = globals().get("preloaded_job_dir") == str(job_dir)
+
+session_file, run_task_file = job_input_files(input_dir, parameters)
+blob_store = BlobStore(job_dir.parent)
+
+if parameters["save_interpreter_state"] and not preloaded:
+    load_interpreter_state(session_file, parameters["save_interpreter_state"], blob_store)
 
 
 job_name = parameters["job_name"]
@@ -53,8 +68,11 @@ N_static_runs = parameters["N_static_runs"]
 keep_runs = parameters["keep_runs"]
 encoding = parameters["encoding"]
 new_task_ids = parameters["new_task_ids"]
+accumulator_dtype = parameters.get("accumulator_dtype")
+trace_memory = parameters.get("trace_memory", False)
+workers_per_task = parameters.get("workers_per_task", 1)
 run_ids_map = (
-    {int(k): v for k, v in parameters["run_ids_map"].items()}
+    {int(k): RunSet.from_json(v, N_runs) for k, v in parameters["run_ids_map"].items()}
     if parameters["run_ids_map"] is not None else None
 )
 
@@ -62,8 +80,8 @@ run_ids_map = (
 if new_task_ids is not None:
     task_id = new_task_ids[task_id - 1]
 
-with open(input_dir / "run_task.d", 'rb') as f:
-    run_task = dill.load(f)
+if not preloaded:
+    run_task = load_with_shared_arrays(run_task_file, blob_store)
 
 function = run_task["function"]
 args = run_task["args"]
@@ -73,41 +91,21 @@ os.environ["JOB_NAME"] = job_name
 
 
 def linear_run_ids():
-    if dynamic_load_balancing:
-        yield from range(task_id - 1, N_static_runs, N_tasks)
-        while True:
-            chunk = None
-            while chunk is None:
-                try:
-                    with SimpleFlock(str(input_dir / "chunks_lock")):
-                        with open(input_dir / "chunks.json", 'r+') as f:
-                            chunks = json.load(f)
-                            if not chunks:
-                                return
-
-                            chunk = chunks.pop()
-                            f.seek(0)
-                            json.dump(chunks, f)
-                            f.truncate()
-                except Exception:
-                    time_mod.sleep(0.5 + 0.5 * random.random())
-                    chunk = None
-
-            yield from range(*chunk)
+    if run_ids_map is not None:
+        yield from run_ids_map[task_id].indices()
+    elif dynamic_load_balancing:
+        scheduler = ChunkScheduler(
+            dynamic_load_balancing, volume(N_runs), N_tasks, N_static_runs,
+            input_dir / "run_counter", progress_dir, task_id
+        )
+        yield from scheduler.run_ids(range(task_id - 1, N_static_runs, N_tasks))
     else:
         yield from range(task_id - 1, volume(N_runs), N_tasks)
 
 
-def run_ids():
-    if run_ids_map is not None:
-        yield from (repr(run_id) for run_id in run_ids_map[task_id])
-    elif isinstance(N_runs, int):
-        yield from (repr(run_id) for run_id in linear_run_ids())
-    else:
-        ranges = [range(n_i) for n_i in N_runs]
-        run_id_list = list(product(*ranges))
-        for linear_run_id in linear_run_ids():
-            yield repr(run_id_list[linear_run_id])
+def run_id_str(linear_run_id):
+    # computed from the linear run id, such that a task never materializes the grid of all run ids
+    return repr(unravel_run_id(linear_run_id, N_runs))
 
 
 def execute_run(run_id):
@@ -123,43 +121,106 @@ def execute_run(run_id):
         print(error_message)
         return None
 
-    try:
-        with open(job_dir / "progress.txt", "a") as f:
-            f.write(run_id + "\n")
-    except Exception:
-        print("Error while writing to progress.txt")
-
     if not isinstance(result, (list, tuple)):
         result = [result]
 
     return result
 
 
+def accumulate(partial_result, run_result):
+    for i, r in enumerate(run_result):
+        if to_be_averaged(i):
+            partial_result[i].add_sample(r)
+        else:
+            partial_result[i] = unbatch(r)
+
+
+def execute_chunk(chunk, partial_result, statistics):
+    """
+    executes the runs of `chunk`, reducing their results into `partial_result` and `statistics`.
+    Returns the successful and failed runs, the raw results (if kept) and the last error message.
+    """
+
+    successful = []
+    failed = []
+    raw_results = []
+    for linear_run_id in chunk:
+        run_result = statistics.measure(lambda: execute_run(run_id_str(linear_run_id)))
+        if run_result is None:
+            failed.append(linear_run_id)
+            continue
+
+        successful.append(linear_run_id)
+        if keep_runs:
+            raw_results.append((linear_run_id, polish([unbatch(r) for r in run_result])))
+        if average_results is not None:
+            accumulate(partial_result, run_result)
+
+    return successful, failed, raw_results, error_message
+
+
+def execute_worker_chunk(chunk):
+    # each worker reduces its runs on its own, such that only partial averages are sent back
+    partial_result = defaultdict(lambda: Dataset(accumulator_dtype))
+    statistics = RunStatistics(trace_memory)
+    outcome = execute_chunk(chunk, partial_result, statistics)
+    return outcome + (dict(partial_result), statistics)
+
+
+def merge(partial_result):
+    for i, r in partial_result.items():
+        if to_be_averaged(i):
+            task_result[i] += r
+        else:
+            task_result[i] = r
+
+
+def executed_chunks():
+    global run_statistics
+
+    if workers_per_task == 1:
+        for linear_run_id in linear_run_ids():
+            yield execute_chunk([linear_run_id], task_result, run_statistics)
+        return
+
+    # imported here, such that names of the loaded session cannot shadow them
+    from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+    from itertools import islice
+    import multiprocessing
+
+    # forking makes the loaded session and function available to the workers without pickling them
+    with ProcessPoolExecutor(workers_per_task, mp_context=multiprocessing.get_context("fork")) as pool:
+        remaining_run_ids = linear_run_ids()
+        pending = set()
+        while True:
+            # run ids are drawn lazily, such that dynamic load balancing only claims what can be executed soon.
+            # Chunks are sized to take about a second, which amortizes the transfer of the partial results.
+            mean_wall_time = run_statistics["wall_time"].mean
+            chunk_size = max(1, min(256, int(1 / mean_wall_time))) if mean_wall_time else 1
+            while len(pending) < 2 * workers_per_task:
+                chunk = list(islice(remaining_run_ids, chunk_size))
+                if not chunk:
+                    break
+                pending.add(pool.submit(execute_worker_chunk, chunk))
+            if not pending:
+                return
+
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                successful, failed, raw_results, chunk_error_message, partial_result, statistics = future.result()
+                run_statistics += statistics
+                merge(partial_result)
+                yield successful, failed, raw_results, chunk_error_message
+
+
 def polish(x):
     if isinstance(x, (list, tuple)) and len(x) == 1:
         x = x[0]
     return x
 
 
-def dump_result_of_single_run(run_id, result):
-    runs_of_task = data_dir / f"{task_id}_raw_results.{encoding}"
-    runs_of_task.touch()
-    with open(runs_of_task, 'r' if encoding == "json" else 'rb') as f:
-        if runs_of_task.stat().st_size == 0:
-            runs = {}
-        else:
-            if encoding == "json":
-                runs = json.load(f)
-            elif encoding == "pickle":
-                runs = pickle.load(f)
-
-    runs[run_id] = polish(result)
-
-    with open(runs_of_task, 'w' if encoding == "json" else 'wb') as f:
-        if encoding == "json":
-            json.dump(runs, f, indent=2, cls=NumpyEncoder)
-        elif encoding == "pickle":
-            pickle.dump(runs, f)
+def unbatch(x):
+    return x.samples if isinstance(x, SampleBatch) else x
 
 
 def dump_task_results(done, throttle):
@@ -175,13 +236,15 @@ def dump_task_results(done, throttle):
             json.dump(
                 {
                     "done": done,
-                    "successful_runs": successful_runs,
-                    "failed_runs": failed_runs,
+                    "successful_runs": successful_runs.to_json(),
+                    "failed_runs": failed_runs.to_json(),
                     "error_message": {
-                        "run_id": failed_runs[-1] if failed_runs else -1,
+                        "run_id": last_failed_run_id,
                         "message": error_message
                     },
-                    "raw_results_map": {run_id: task_id for run_id in successful_runs} if keep_runs else None,
+                    "raw_results_map": {task_id: successful_runs.to_json()} if keep_runs else None,
+                    "timing": run_statistics.to_json(),
+                    "lock_statistics": lock_statistics(),
                     "task_result": [
                         task_result[i].to_json() if isinstance(task_result[i], Dataset) else task_result[i]
                         for i in sorted(task_result)
@@ -194,28 +257,33 @@ def dump_task_results(done, throttle):
     last_dump_timestamp = time_mod.time()
 
 
-task_result = defaultdict(lambda: Dataset())
-successful_runs = []
-failed_runs = []
+task_result = defaultdict(lambda: Dataset(accumulator_dtype))
+successful_runs = RunSet([], N_runs)
+failed_runs = RunSet([], N_runs)
+last_failed_run_id = -1
 error_message = ""
 last_dump_timestamp = time_mod.time()
+raw_results_file = RawResultsFile(data_dir, task_id, encoding)
+task_progress = TaskProgress(progress_dir, task_id)
+run_statistics = RunStatistics(trace_memory)
+
+for successful, failed, raw_results, chunk_error_message in executed_chunks():
+    for linear_run_id in failed:
+        failed_runs.add_index(linear_run_id)
+        last_failed_run_id = run_id_str(linear_run_id)
+        error_message = chunk_error_message
+
+    for linear_run_id in successful:
+        successful_runs.add_index(linear_run_id)
+    for linear_run_id, result in raw_results:
+        raw_results_file.append(run_id_str(linear_run_id), result)
+    if successful:
+        dump_task_results(done=False, throttle=True)
 
-for run_id in run_ids():
-    run_result = execute_run(run_id)
-    if run_result is None:
-        failed_runs.append(run_id)
-    else:
-        successful_runs.append(run_id)
-        if keep_runs:
-            dump_result_of_single_run(run_id, run_result)
-
-        if average_results is not None:
-            for i, r in enumerate(run_result):
-                if to_be_averaged(i):
-                    task_result[i].add_sample(r)
-                else:
-                    task_result[i] = r
+    task_progress.update(len(successful_runs), len(failed_runs))
 
-        dump_task_results(done=False, throttle=True)
+if keep_runs and raw_results_file.is_log:
+    raw_results_file.finalize()
 
 dump_task_results(done=True, throttle=False)
+task_progress.update(len(successful_runs), len(failed_runs), done=True)
@@ -0,0 +1,121 @@
+"""
+Policies for dynamic load balancing. Apart from an optional static share of runs, each task repeatedly claims a range of
+consecutive runs from a counter shared by all tasks of a job, until all runs are claimed. The policies only differ in
+the size of these chunks:
+
+chunked:  the first quarter of all runs is distributed statically, the rest in fixed chunks of a third of the
+          remaining runs per task. This is what `dynamic_load_balancing=True` selects.
+guided:   each chunk is a fixed fraction of the runs that are still unclaimed, hence chunks shrink as the pool drains.
+adaptive: like guided, but the fraction is weighted by the run rate of the claiming task relative to all running tasks
+          of the job, as measured from the progress files. Slow tasks claim less and all tasks finish close together.
+          The progress files are read at most once per flush interval of the progress.
+
+The chunks of guided and adaptive do not shrink below a minimum, such that each task claims about `max_claims_per_task`
+times at most.
+"""
+
+from .AtomicCounter import AtomicCounter
+from .progress import load_task_progress, task_rate, flush_interval
+import time
+
+
+policies = ["chunked", "guided", "adaptive"]
+# like the minimum chunk size of OpenMP's guided schedule, this bounds the number of claims of the shrinking policies
+max_claims_per_task = 100
+
+
+def resolve_policy(dynamic_load_balancing):
+    if dynamic_load_balancing is False or dynamic_load_balancing is None:
+        return None
+    if dynamic_load_balancing is True:
+        return "chunked"
+    if dynamic_load_balancing not in policies:
+        raise ValueError(
+            f"Unknown scheduling policy: {dynamic_load_balancing}\n"
+            f"Supported options are: {policies}"
+        )
+    return dynamic_load_balancing
+
+
+def static_runs(policy, N_runs):
+    return N_runs // 4 if policy == "chunked" else 0
+
+
+class ChunkScheduler:
+    def __init__(self, policy, N_runs, N_tasks, N_static_runs, counter_path, progress_path, task_id):
+        self.policy = policy
+        self.N_runs = N_runs
+        self.N_tasks = N_tasks
+        self.N_static_runs = N_static_runs
+        self.counter = AtomicCounter(counter_path)
+        self.progress_path = progress_path
+        self.task_id = task_id
+        self.started = time.time()
+        self.executed_runs = 0
+        self.min_chunk_size = max(1, (N_runs - N_static_runs) // (max_claims_per_task * N_tasks))
+        # the progress of the other tasks, which is only flushed every `flush_interval` seconds anyway
+        self.other_tasks = None
+        self.other_tasks_loaded = None
+
+    @property
+    def share(self):
+        """returns the fraction of the throughput of all running tasks that is contributed by this task"""
+
+        duration = time.time() - self.started
+        if self.executed_runs == 0 or duration <= 0:
+            return None
+
+        rate = self.executed_runs / duration
+        if self.other_tasks is None or time.time() - self.other_tasks_loaded >= flush_interval:
+            self.other_tasks = [
+                task for task_id, task in load_task_progress(self.progress_path).items()
+                if task_id != self.task_id
+            ]
+            self.other_tasks_loaded = time.time()
+
+        others = self.other_tasks
+        running = [task for task in others if not task["done"]]
+        unknown = max(self.N_tasks - 1 - len(others), 0)
+
+        # tasks which have not reported any progress yet are assumed to be as fast as this one
+        total_rate = rate * (1 + unknown) + sum(task_rate(task) for task in running)
+        return min(rate / total_rate, 1)
+
+    def chunk_size(self, claimed, share):
+        remaining = self.N_runs - claimed
+
+        if self.policy == "chunked":
+            return max(1, (self.N_runs - self.N_static_runs) // 3 // self.N_tasks)
+        elif self.policy == "guided":
+            return max(self.min_chunk_size, remaining // (2 * self.N_tasks))
+        else:
+            # before its first run, a task cannot know its rate
+            return self.min_chunk_size if share is None else max(self.min_chunk_size, int(share * remaining / 2))
+
+    def claim(self):
+        """returns the range of runs claimed next by this task, or None if all runs are claimed"""
+
+        share = self.share if self.policy == "adaptive" else None
+        start, end = self.counter.update(
+            lambda claimed: claimed + self.chunk_size(claimed, share) if claimed < self.N_runs else claimed
+        )
+        if start >= self.N_runs:
+            return None
+
+        return range(start, min(end, self.N_runs))
+
+    def run_ids(self, static_run_ids):
+        """yields the given static runs and then dynamically claimed runs, counting the runs executed so far"""
+
+        for run_id in static_run_ids:
+            yield run_id
+            self.executed_runs += 1
+
+        while True:
+            chunk = self.claim()
+            if chunk is None:
+                return
+
+            for run_id in chunk:
+                yield run_id
+                self.executed_runs += 1
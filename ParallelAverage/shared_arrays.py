@@ -0,0 +1,88 @@
+"""
+Large numpy arrays among the inputs of a job (its arguments and its interpreter state) can be spilled to `.npy` files
+in the blob store. Tasks load them as read-only memory maps, such that all tasks on a node share the pages of
+an array in the page cache instead of each holding a private copy.
+
+Within pickled data, spilled arrays are replaced by persistent ids. Top-level globals of a full session are replaced
+by `SharedArray` placeholders instead, since `dill.dump_session` does not allow for a custom pickler.
+"""
+
+from .json_numpy import fingerprint, save_npy, load_npy
+import numpy as np
+import dill
+import io
+
+
+default_share_threshold = 2**20
+
+
+class SharedArray:
+    def __init__(self, key):
+        self.key = key
+
+
+class SharedArrays:
+    """spills arrays of at least `threshold` bytes to `blob_store` and keeps track of their keys"""
+
+    def __init__(self, blob_store, threshold):
+        self.blob_store = blob_store
+        self.threshold = threshold
+        self.keys = set()
+        # id -> (array, key), such that each array is hashed only once per submission
+        self.spilled = {}
+
+    def should_spill(self, obj):
+        return isinstance(obj, np.ndarray) and not obj.dtype.hasobject and obj.nbytes >= self.threshold
+
+    def spill(self, arr):
+        if id(arr) in self.spilled:
+            return self.spilled[id(arr)][1]
+
+        key = fingerprint(arr)["sha1"] + ".npy"
+        blob_file = self.blob_store.file(key)
+        if not self.blob_store.touch(key):
+            self.blob_store.path.mkdir(exist_ok=True)
+            save_npy(blob_file, arr)
+
+        self.keys.add(key)
+        self.spilled[id(arr)] = (arr, key)
+        return key
+
+    def dumps(self, obj):
+        f = io.BytesIO()
+        SpillingPickler(f, self).dump(obj)
+        return f.getvalue()
+
+
+class SpillingPickler(dill.Pickler):
+    def __init__(self, file, shared_arrays):
+        super().__init__(file)
+        self.shared_arrays = shared_arrays
+
+    def persistent_id(self, obj):
+        if self.shared_arrays.should_spill(obj):
+            return ("npy", self.shared_arrays.spill(obj))
+        return None
+
+
+class SharingUnpickler(dill.Unpickler):
+    def __init__(self, file, blob_store):
+        super().__init__(file)
+        self.blob_store = blob_store
+
+    def persistent_load(self, pid):
+        kind, key = pid
+        return load_npy(self.blob_store.file(key))
+
+
+def load(path, blob_store):
+    """unpickles the file at `path`, whose spilled arrays are memory-mapped from `blob_store`"""
+
+    with open(path, 'rb') as f:
+        return SharingUnpickler(f, blob_store).load()
+
+
+def resolve_shared_arrays(namespace, blob_store):
+    for name, obj in list(namespace.items()):
+        if isinstance(obj, SharedArray):
+            namespace[name] = load_npy(blob_store.file(obj.key))
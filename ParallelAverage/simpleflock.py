@@ -3,55 +3,103 @@ import time
 import os
 import fcntl
 import errno
-import random
+import threading
+from collections import defaultdict
+
+
+_statistics_lock = threading.Lock()
+_statistics = defaultdict(lambda: dict(acquisitions=0, contended=0, total_wait=0.0, max_wait=0.0))
+
+
+def lock_statistics():
+   """Returns the lock-wait statistics of this process per lock file: number of acquisitions, how many of them had to wait, and the total and maximal waiting time in seconds.
+
+   These only cover the calling process. Tasks store theirs in their output, from where they are gathered per job.
+   """
+   with _statistics_lock:
+      return {path: dict(stats) for path, stats in _statistics.items()}
+
+
+def merged_lock_statistics(*statistics):
+   """Merges lock-wait statistics of several processes, e.g. of the tasks of a job."""
+   merged = defaultdict(lambda: dict(acquisitions=0, contended=0, total_wait=0.0, max_wait=0.0))
+   for stats_by_path in statistics:
+      for path, stats in stats_by_path.items():
+         total = merged[path]
+         total["acquisitions"] += stats["acquisitions"]
+         total["contended"] += stats["contended"]
+         total["total_wait"] += stats["total_wait"]
+         total["max_wait"] = max(total["max_wait"], stats["max_wait"])
+   return {path: dict(stats) for path, stats in merged.items()}
+
+
+def reset_lock_statistics():
+   with _statistics_lock:
+      _statistics.clear()
 
 
 class SimpleFlock:
-   """Provides the simplest possible interface to flock-based file locking. Intended for use with the `with` syntax. It will create/truncate/delete the lock file as necessary."""
+   """Provides the simplest possible interface to flock-based file locking. Intended for use with the `with` syntax.
+
+   The lock file is created if necessary and is never removed, such that all processes always lock the same inode.
+   Acquiring a contended lock blocks in the kernel. If `timeout` is given, the lock is polled with an exponential backoff
+   instead and a `TimeoutError` is raised when the timeout is exceeded.
+   Shared locks (`shared=True`) can be held by several readers at once, while an exclusive lock excludes everybody else.
+   """
 
-   def __init__(self, path, timeout = None):
+   def __init__(self, path, timeout = None, shared = False):
       self._path = path
       self._timeout = timeout
+      self._operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
       self._fd = None
 
+   def _try_lock(self):
+      try:
+         fcntl.flock(self._fd, self._operation | fcntl.LOCK_NB)
+         return True
+      except (OSError, IOError) as ex:
+         if ex.errno not in (errno.EAGAIN, errno.EACCES): # Resource temporarily unavailable
+            raise
+         return False
+
    def __enter__(self):
-      self._fd = os.open(self._path, os.O_CREAT)
-      start_lock_search = time.time()
-      while True:
-         try:
-            fcntl.flock(self._fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
-            # Lock acquired!
-            return
-         except (OSError, IOError) as ex:
-            if ex.errno != errno.EAGAIN: # Resource temporarily unavailable
-               raise
-            elif self._timeout is not None and time.time() > (start_lock_search + self._timeout):
-               # Exceeded the user-specified timeout.
-               raise
-
-         # TODO It would be nice to avoid an arbitrary sleep here, but spinning
-         # without a delay is also undesirable.
-         time.sleep(0.5 + 0.5 * random.random())
+      self._fd = os.open(self._path, os.O_CREAT | os.O_RDWR, 0o666)
+      start_lock_search = time.perf_counter()
+      contended = not self._try_lock()
+
+      try:
+         if contended and self._timeout is None:
+            fcntl.flock(self._fd, self._operation)
+         elif contended:
+            delay = 0.001
+            while not self._try_lock():
+               if time.perf_counter() > start_lock_search + self._timeout:
+                  # Exceeded the user-specified timeout.
+                  raise TimeoutError(f"Could not acquire lock {self._path} within {self._timeout} s")
+               time.sleep(delay)
+               delay = min(2 * delay, 0.1)
+      except BaseException:
+         os.close(self._fd)
+         self._fd = None
+         raise
+
+      wait = time.perf_counter() - start_lock_search
+      with _statistics_lock:
+         stats = _statistics[str(self._path)]
+         stats["acquisitions"] += 1
+         stats["contended"] += contended
+         stats["total_wait"] += wait if contended else 0.0
+         stats["max_wait"] = max(stats["max_wait"], wait if contended else 0.0)
 
    def __exit__(self, *args):
       fcntl.flock(self._fd, fcntl.LOCK_UN)
       os.close(self._fd)
       self._fd = None
 
-      # Try to remove the lock file, but don't try too hard because it is
-      # unnecessary. This is mostly to help the user see whether a lock
-      # exists by examining the filesystem.
-      try:
-         os.unlink(self._path)
-      except:
-         pass
-
 if __name__ == "__main__":
    print("Acquiring lock...")
    with SimpleFlock("locktest", 2):
       print("Lock acquired.")
       time.sleep(3)
    print("Lock released.")
-
-
-
+   print(lock_statistics())
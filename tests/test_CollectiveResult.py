@@ -0,0 +1,49 @@
+import weakref
+
+import numpy as np
+
+import ParallelAverage.RawResultsFile as raw_results_module
+from ParallelAverage.CollectiveResult import CollectiveResult, file_size
+from ParallelAverage.JobPath import JobPath
+from ParallelAverage.RunSet import RunSet
+
+
+class DecodedRuns(dict):
+    pass
+
+
+def test_items_holds_at_most_the_cache(tmp_path, monkeypatch):
+    job_path = JobPath(tmp_path / "job")
+    N_runs, N_files = 40, 4
+    raw_results_map = {}
+    for file_id in range(1, N_files + 1):
+        # the runs of the files interleave, as those of tasks executing their runs round-robin
+        runs = RunSet([[file_id - 1, N_runs, N_files]], N_runs)
+        raw_results_file = raw_results_module.RawResultsFile(job_path.data_path, file_id, "json")
+        for run_id in runs:
+            raw_results_file.append(repr(run_id), np.full(100, run_id))
+        raw_results_file.finalize()
+        raw_results_map[str(file_id)] = runs.to_json()
+
+    size = file_size(raw_results_module.RawResultsFile(job_path.data_path, 1, "json"))
+    cache_size = 2 * size + size // 2
+
+    decoded = weakref.WeakValueDictionary()
+    load_all = raw_results_module.RawResultsFile.load_all
+
+    def tracked_load_all(self):
+        runs = DecodedRuns(load_all(self))
+        decoded[id(runs)] = runs
+        return runs
+
+    monkeypatch.setattr(raw_results_module.RawResultsFile, "load_all", tracked_load_all)
+
+    result = CollectiveResult(
+        RunSet.full(N_runs), job_path, raw_results_map, "f", "json", cache_size=cache_size
+    )
+    run_ids = []
+    for run_id, run in result.items():
+        assert len(decoded) * size <= cache_size
+        assert np.all(run == run_id)
+        run_ids.append(run_id)
+    assert run_ids == list(range(N_runs))
@@ -0,0 +1,36 @@
+import numpy as np
+
+from ParallelAverage.Dataset import Dataset, SampleBatch, WeightedSample
+
+
+def accumulated_bytes(dataset):
+    arrays = [value for value in vars(dataset).values() if isinstance(value, np.ndarray)]
+    arrays += dataset.moments or []
+    return sum(array.nbytes for array in arrays)
+
+
+def test_single_precision_estimated_error():
+    rng = np.random.default_rng(0)
+    # a mean well above the spread, which the difference of raw sums of squares cannot resolve in single precision
+    samples = 100 + rng.standard_normal((2000, 64)) + 1j * rng.standard_normal((2000, 64))
+    weights = rng.uniform(0.5, 2, len(samples))
+
+    datasets = [Dataset("complex64"), Dataset("complex64"), Dataset()]
+    for sample, weight in zip(samples[:1000], weights[:1000]):
+        datasets[0].add_sample(WeightedSample(sample, weight))
+        datasets[2].add_sample(WeightedSample(sample, weight))
+    datasets[1].add_sample(SampleBatch(samples[1000:], weights[1000:]))
+    datasets[2].add_sample(SampleBatch(samples[1000:], weights[1000:]))
+
+    single = Dataset()
+    single += Dataset.from_json(datasets[0].to_json())
+    single += datasets[1]
+    double = datasets[2]
+
+    assert single.num_samples == double.num_samples == len(samples)
+    assert np.all(abs(single.mean - double.mean) < 0.01 * double.estimated_error)
+    assert np.allclose(single.estimated_error, double.estimated_error, rtol=1e-3, atol=0)
+    assert np.allclose(single.estimated_variance, double.estimated_variance, rtol=1e-3, atol=0)
+
+    assert datasets[0].mean.dtype == np.complex64
+    assert accumulated_bytes(datasets[0]) * 2 == accumulated_bytes(double)
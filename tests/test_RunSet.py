@@ -0,0 +1,69 @@
+import random
+
+import pytest
+
+import ParallelAverage.RunSet as run_set_module
+from ParallelAverage.RunSet import RunSet
+
+
+def random_indices(N):
+    indices = set()
+    for i in range(random.randint(0, 4)):
+        start = random.randint(0, N)
+        indices |= set(range(start, random.randint(start, N), random.randint(1, 6)))
+    if random.random() < 0.3:
+        indices |= set(random.sample(range(N), random.randint(0, 10)))
+    return indices
+
+
+def check(run_set, indices):
+    assert list(run_set.indices()) == sorted(indices)
+    assert len(run_set) == len(indices)
+    assert all(run_set.contains_index(i) == (i in indices) for i in range(-1, 62))
+    assert [run_set.rank(i) for i in sorted(indices)] == list(range(len(indices)))
+    assert list(RunSet.from_json(run_set.to_json()).indices()) == sorted(indices)
+
+
+def test_set_operations():
+    random.seed(0)
+    for i in range(1000):
+        a, b = random_indices(60), random_indices(60)
+        A, B = RunSet.from_run_ids(a, 60), RunSet.from_run_ids(b, 60)
+        check(A | B, a | b)
+        check(A - B, a - b)
+
+        n = random.randint(1, 7)
+        parts = A.split(n)
+        for j, part in enumerate(parts):
+            check(part, set(sorted(a)[j::n]))
+
+        union = RunSet([], 60)
+        for part in parts:
+            union = union | part
+        check(union, a)
+
+
+def test_union_of_round_robin_shares_is_arithmetic(monkeypatch):
+    # the runs of the shares must never be iterated
+    def block_indices(b):
+        raise AssertionError("expanded a block into its runs")
+
+    monkeypatch.setattr(run_set_module, "block_indices", block_indices)
+
+    N_runs, N_tasks = 10**6, 100
+    shares = RunSet.full(N_runs).split(N_tasks)
+    assert all(len(share.blocks) == 1 for share in shares)
+
+    union = RunSet([], N_runs)
+    for share in shares:
+        union = union | share
+    assert union.blocks == RunSet.full(N_runs).blocks
+
+    # tasks which have finished a different number of their runs
+    finished = RunSet([], N_runs)
+    for task_id in range(N_tasks):
+        finished = finished | RunSet([[task_id, task_id + N_tasks * (1000 + 10 * task_id), N_tasks]], N_runs)
+    assert len(finished.blocks) <= N_tasks
+    assert len(finished) == sum(1000 + 10 * task_id for task_id in range(N_tasks))
+
+    assert (RunSet.full(N_runs) - finished) | finished == RunSet.full(N_runs)
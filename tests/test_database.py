@@ -0,0 +1,26 @@
+import pytest
+
+from ParallelAverage.database import JsonDatabase, SqliteDatabase
+
+
+def entry(job_name, *args, **kwargs):
+    return dict(
+        job_name=job_name, function_name="f", args=list(args), kwargs=kwargs, N_runs=10, average_results=None
+    )
+
+
+@pytest.mark.parametrize("backend", [JsonDatabase, SqliteDatabase])
+def test_backends_agree_on_equal_numbers(tmp_path, backend):
+    database = backend(tmp_path)
+    database.save(entry("1_f", 1, scale=2.0, flag=True))
+
+    for equal in [entry("", 1.0, scale=2, flag=1), entry("", True, scale=2.0, flag=1.0)]:
+        assert database.find(equal)["job_name"] == "1_f"
+    for different in [entry("", 1.5, scale=2.0, flag=True), entry("", 1, scale=2.0, flag=False)]:
+        assert database.find(different) is None
+
+    database.save(entry("2_f", 1.0, scale=2, flag=True))
+    assert [e["job_name"] for e in database.load()] == ["2_f"]
+
+    database.remove_all([entry("", 1, scale=2.0, flag=1)])
+    assert database.load() == []